@@ -6,6 +6,7 @@ from flask_cors import CORS
 from datetime import datetime
 import os
 from dotenv import load_dotenv
+from ratelimit import RateLimiter, parse_limit, parse_rules, retry_after_header
 
 # Load environment variables
 load_dotenv()
@@ -14,9 +15,42 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# Token-bucket rate limits per client IP ("<METHOD> <path> <count>/<period>"; see ratelimit.py)
+rate_limiter = RateLimiter(
+    parse_rules(os.getenv('RATE_LIMITS', """
+        POST /api/auth/login 10/min
+        POST /api/auth/signup 5/min
+        POST /api/auth/forgot-password 5/hour
+        POST /api/auth/google 20/min
+        POST /api/auth/facebook 20/min
+    """)),
+    # Number of reverse proxies in front of the app (0 = none, use the socket peer)
+    trust_proxy=int(os.getenv('TRUST_PROXY') or '0'),
+)
+# Login attempts per email/phone, whichever IPs they come from
+LOGIN_ACCOUNT_LIMIT = parse_limit(os.getenv('LOGIN_ACCOUNT_LIMIT', '10/15min'))
+
 # Firebase Configuration
 # TODO: আপনার Firebase credentials এখানে যোগ করুন
 
+# ==================== RATE LIMITING ====================
+
+def too_many_requests(retry_after):
+    return jsonify({'success': False, 'message': 'Too many requests'}), 429, {
+        'Retry-After': retry_after_header(retry_after)
+    }
+
+
+@app.before_request
+def apply_rate_limits():
+    """Reject requests over their route's limit (runs inside Flask so CORS headers still apply)"""
+    ip = rate_limiter.client_ip(request.remote_addr,
+                                ', '.join(request.headers.getlist('X-Forwarded-For')) or None)
+    retry_after = rate_limiter.check(request.method, request.path, ip, request.headers.get('Authorization'))
+    if retry_after:
+        return too_many_requests(retry_after)
+
+
 # ==================== AUTHENTICATION ROUTES ====================
 
 @app.route('/api/auth/signup', methods=['POST'])
@@ -83,6 +117,10 @@ def login():
         if 'email_or_phone' not in data or 'password' not in data:
             return jsonify({'success': False, 'message': 'Missing credentials'}), 400
         
+        retry_after = rate_limiter.hit('login', str(data['email_or_phone']).strip().lower(), LOGIN_ACCOUNT_LIMIT)
+        if retry_after:
+            return too_many_requests(retry_after)
+        
         # TODO: Firebase এ user verify করুন
         # TODO: Token generate করুন
         
@@ -0,0 +1,178 @@
+"""
+Economy Simulator
+Vectorized Monte-Carlo simulation of player bankrolls under the probability controller's settings
+"""
+
+import os
+from typing import Dict, Optional
+
+try:
+    import numpy as np
+except ImportError:  # pip install numpy to enable simulations
+    np = None
+
+from probabilityControl import ProbabilityController, probability_controller
+
+DIFFICULTIES = ["easy", "normal", "hard", "expert"]
+ADAPTIVE = "adaptive"
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+
+
+class EconomySimulator:
+    def __init__(self, controller: ProbabilityController, max_player_rounds: int = 200_000_000,
+                 max_players: int = 2_000_000, max_rounds: int = 10_000):
+        """
+        Args:
+            controller: Supplies probabilities, difficulty multipliers and house edge
+            max_player_rounds: Upper bound on players x rounds per run (bounds CPU time)
+            max_players: Upper bound on players per run (bounds memory: about
+                100 bytes per player across the working arrays)
+            max_rounds: Upper bound on rounds per run (rounds are a Python-level
+                loop, so this bounds run time even for a handful of players)
+        """
+        self.controller = controller
+        self.max_player_rounds = max_player_rounds
+        self.max_players = max_players
+        self.max_rounds = max_rounds
+
+    @staticmethod
+    def available() -> bool:
+        return np is not None
+
+    def _adaptive_difficulty(self, wins, losses):
+        """
+        Vectorized adjust_difficulty_for_player_level: indexes into DIFFICULTIES
+        (normal under 10 games, hard above 60% wins, normal above 50%, else easy)
+        """
+        played = wins + losses
+        win_rate = np.divide(wins, played, out=np.zeros(played.shape), where=played > 0)
+        index = np.where(win_rate > 0.6, 2, np.where(win_rate > 0.5, 1, 0))
+        return np.where(played < 10, 1, index)
+
+    def simulate(self, game_id: str, entry_fee: int, reward: int, players: int = 10000,
+                 rounds: int = 100, starting_balance: int = 1000, difficulty: str = ADAPTIVE,
+                 seed: Optional[int] = None) -> Dict:
+        """
+        Simulate players each playing up to rounds rounds of one game
+
+        Every player starts with starting_balance and stops once they can't
+        pay the entry fee (ruin). A round is settled like
+        WalletLedger.settle_round: the fee is always charged and the reward
+        paid on a win. With difficulty="adaptive" each player's
+        difficulty is re-picked every round from their win/loss record, as
+        adjust_difficulty_for_player_level does.
+
+        Args:
+            game_id: Game identifier
+            entry_fee: Coins charged per round
+            reward: Coins paid on a win
+            players: Number of simulated players (N)
+            rounds: Rounds per player (M)
+            starting_balance: Initial coins per player
+            difficulty: A fixed difficulty level or "adaptive"
+            seed: RNG seed; the same seed and settings give the same result
+
+        Returns:
+            Distribution summaries for balances, ruin and coin flow
+        """
+        if np is None:
+            raise RuntimeError("numpy is required for simulations")
+        if players <= 0 or rounds <= 0 or entry_fee <= 0 or starting_balance <= 0:
+            raise ValueError("players, rounds, entry_fee and starting_balance must be positive")
+        if reward < 0:
+            raise ValueError("reward must not be negative")
+        if players > self.max_players:
+            raise ValueError(f"players must be at most {self.max_players}")
+        if rounds > self.max_rounds:
+            raise ValueError(f"rounds must be at most {self.max_rounds}")
+        if players * rounds > self.max_player_rounds:
+            raise ValueError(f"players x rounds must be at most {self.max_player_rounds}")
+        if difficulty != ADAPTIVE and difficulty not in DIFFICULTIES:
+            raise ValueError(f"difficulty must be one of {DIFFICULTIES + [ADAPTIVE]}")
+
+        rng = np.random.default_rng(seed)
+        # Win probability per difficulty, with house edge and clamping applied by the controller
+        win_prob = np.array([self.controller.get_win_probability(game_id, d) for d in DIFFICULTIES])
+
+        balance = np.full(players, starting_balance, dtype=np.int64)
+        wins = np.zeros(players, dtype=np.int64)
+        losses = np.zeros(players, dtype=np.int64)
+        ruined_at = np.full(players, -1, dtype=np.int64)
+        level = np.full(players, DIFFICULTIES.index(difficulty) if difficulty != ADAPTIVE else 1)
+        checkpoints = {}
+
+        for round_number in range(rounds):
+            active = balance >= entry_fee
+            newly_ruined = ~active & (ruined_at < 0)
+            ruined_at[newly_ruined] = round_number
+            if not active.any():
+                break
+            if difficulty == ADAPTIVE:
+                level = self._adaptive_difficulty(wins, losses)
+            won = active & (rng.random(players, dtype=np.float32) < win_prob[level])
+            lost = active & ~won
+            balance -= active * entry_fee
+            balance += won * reward
+            wins += won
+            losses += lost
+            if (round_number + 1) % max(1, rounds // 10) == 0:
+                checkpoints[round_number + 1] = round(float((balance < entry_fee).mean()), 6)
+
+        still_ruined = (balance < entry_fee) & (ruined_at < 0)
+        ruined_at[still_ruined] = rounds
+        ruined = ruined_at >= 0
+
+        played = wins + losses
+        total_start = starting_balance * players
+        fees = int(played.sum()) * entry_fee
+        payouts = int(wins.sum()) * reward
+        final_levels = self._adaptive_difficulty(wins, losses) if difficulty == ADAPTIVE else level
+        # Single-round closed form, at the difficulty every player starts on
+        start_difficulty = "normal" if difficulty == ADAPTIVE else difficulty
+
+        return {
+            "game_id": game_id,
+            "players": players,
+            "rounds": rounds,
+            "seed": seed,
+            "difficulty": difficulty,
+            "entry_fee": entry_fee,
+            "reward": reward,
+            "starting_balance": starting_balance,
+            "win_probability": dict(zip(DIFFICULTIES, map(float, win_prob))),
+            "final_balance": {
+                "mean": float(balance.mean()),
+                "std": float(balance.std()),
+                "min": int(balance.min()),
+                "max": int(balance.max()),
+                "percentiles": dict(zip(map(str, PERCENTILES),
+                                        map(float, np.percentile(balance, PERCENTILES)))),
+            },
+            "risk_of_ruin": float(ruined.mean()),
+            "ruin_by_round": checkpoints,
+            "median_rounds_to_ruin": float(np.median(ruined_at[ruined])) if ruined.any() else None,
+            "rounds_played": int(played.sum()),
+            "empirical_win_rate": float(wins.sum() / played.sum()) if played.sum() else 0.0,
+            "house": {
+                "fees": fees,
+                "payouts": payouts,
+                "profit": fees - payouts,
+                "margin_percentage": (fees - payouts) / fees * 100 if fees else 0.0,
+                "expected_margin_percentage": self.controller.get_house_profit_margin(
+                    game_id, entry_fee, reward, start_difficulty),
+            },
+            # Net coins created (positive) or removed (negative) relative to the starting supply
+            "coin_inflation": (int(balance.sum()) - total_start) / total_start,
+            "final_difficulty_mix": {
+                d: float((final_levels == i).mean()) for i, d in enumerate(DIFFICULTIES)
+            },
+        }
+
+
+# Global instance
+economy_simulator = EconomySimulator(
+    probability_controller,
+    max_player_rounds=int(os.getenv("GAME_SIM_MAX_PLAYER_ROUNDS", "200000000")),
+    max_players=int(os.getenv("GAME_SIM_MAX_PLAYERS", "2000000")),
+    max_rounds=int(os.getenv("GAME_SIM_MAX_ROUNDS", "10000")),
+)
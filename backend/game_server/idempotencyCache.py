@@ -0,0 +1,108 @@
+"""
+Idempotency Cache
+Remembers the result of requests that carried an idempotency key so retries don't repeat them
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class IdempotencyConflict(ValueError):
+    pass
+
+
+class _Entry:
+    def __init__(self, fingerprint: Hashable):
+        self.fingerprint = fingerprint
+        self.done = threading.Event()
+        self.result: Any = None
+        self.ok = False
+        self.expires = 0.0
+
+
+class IdempotencyCache:
+    def __init__(self, max_entries: int = 100000, ttl: float = 24 * 3600):
+        """
+        Bounded LRU of completed results that also expire after ttl seconds
+
+        Args:
+            max_entries: Most results kept; the least recently used go first
+            ttl: Seconds a result can be replayed for
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.replayed = 0
+
+    def run(self, key: Hashable, fingerprint: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn once per key and return its result; later calls with the same
+        key get the stored result without running fn. A call that arrives
+        while the first is still running waits for it. Only successful results
+        are kept: if fn raises, the key is released so the request can be retried.
+
+        Args:
+            key: Idempotency key (scope it to the user and endpoint)
+            fingerprint: The request's parameters; reusing a key with different ones is an error
+            fn: The operation
+
+        Raises:
+            IdempotencyConflict: If key was used with a different fingerprint
+        """
+        while True:
+            with self._lock:
+                entry = self._get(key)
+                if entry is None:
+                    entry = _Entry(fingerprint)
+                    self._entries[key] = entry
+                    owner = True
+                else:
+                    owner = False
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyConflict("Idempotency key was already used for a different request")
+            if owner:
+                break
+            entry.done.wait()
+            if entry.ok:
+                self.replayed += 1
+                return entry.result
+            # The first attempt failed and released the key; try to claim it
+
+        try:
+            entry.result = fn()
+            entry.ok = True
+        finally:
+            with self._lock:
+                if entry.ok:
+                    entry.expires = time.monotonic() + self.ttl
+                    self._evict()
+                elif self._entries.get(key) is entry:
+                    del self._entries[key]
+            entry.done.set()
+        return entry.result
+
+    def _get(self, key: Hashable) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.ok and entry.expires <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _evict(self):
+        now = time.monotonic()
+        # Least recently used first; expired results go whatever the size
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            expired = entry.ok and entry.expires <= now
+            if not expired and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -3,10 +3,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
+from typing import List, Optional
 import json
 import os
 from datetime import datetime
 from probabilityControl import probability_controller
+from walletLedger import BatchRejected, wallet_ledger
+from idempotencyCache import IdempotencyCache, IdempotencyConflict
+from economySimulator import economy_simulator
 
 app = FastAPI(title="Game Server API")
 
@@ -32,16 +36,31 @@ class CoinDeductRequest(BaseModel):
     user_id: str
     amount: int
     game_name: str
+    idempotency_key: Optional[str] = None
 
 class CoinRewardRequest(BaseModel):
     user_id: str
     amount: int
     game_name: str
+    idempotency_key: Optional[str] = None
 
-# In-memory wallet (replace with real database)
-user_wallets = {}
+class WalletOperation(BaseModel):
+    user_id: str
+    type: str  # "deduct" or "reward"
+    amount: int
+    game_name: Optional[str] = None
+
+class WalletBatchRequest(BaseModel):
+    operations: List[WalletOperation]
+    idempotency_key: Optional[str] = None
+
+class PlayRoundRequest(BaseModel):
+    user_id: str
+    idempotency_key: Optional[str] = None
 
 # Game configuration
+# Rounds played through /api/games/{id}/play are settled at a game's "difficulty"
+# (default "normal"); it is set here, never by the client
 GAME_CONFIG = {
     "ludo": {"entry_fee": 10, "reward": 20, "enabled": True, "win_probability": 0.45},
     "carrom": {"entry_fee": 20, "reward": 40, "enabled": True, "win_probability": 0.40},
@@ -55,11 +74,33 @@ GAME_CONFIG = {
     "tic_tac_toe": {"entry_fee": 5, "reward": 10, "enabled": True, "win_probability": 0.50},
 }
 
-# Initialize user wallet helper
+# Results of wallet requests that carried an idempotency_key, replayed on retries
+idempotency_cache = IdempotencyCache(
+    max_entries=int(os.getenv("GAME_IDEMPOTENCY_MAX", "100000")),
+    ttl=float(os.getenv("GAME_IDEMPOTENCY_TTL_HOURS", "24")) * 3600,
+)
+
+def run_idempotent(endpoint: str, request, fingerprint, operation):
+    """Run operation() once per (endpoint, user, idempotency_key); retries get the first response"""
+    if not request.idempotency_key:
+        return operation()
+    key = (endpoint, getattr(request, "user_id", None), request.idempotency_key)
+    try:
+        return idempotency_cache.run(key, fingerprint, operation)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+# Most operations accepted in one /api/wallet/batch request
+WALLET_BATCH_MAX = int(os.getenv("GAME_WALLET_BATCH_MAX", "10000"))
+
+# User wallet helper (balances live in walletLedger.py; new wallets start with 1000 coins)
 def get_user_wallet(user_id: str):
-    if user_id not in user_wallets:
-        user_wallets[user_id] = 1000  # Starting balance
-    return user_wallets[user_id]
+    return wallet_ledger.balance(user_id)
+
+@app.on_event("shutdown")
+def close_wallets():
+    """Snapshot balances so the next start has no log to replay"""
+    wallet_ledger.close()
 
 @app.get("/")
 def read_root():
@@ -80,53 +121,116 @@ def check_coin(request: CoinCheckRequest):
 
 @app.post("/api/deductCoin")
 def deduct_coin(request: CoinDeductRequest):
-    """Deduct coins when user enters a game"""
-    balance = get_user_wallet(request.user_id)
+    """Deduct coins when user enters a game (send idempotency_key to make retries safe)"""
+    def deduct():
+        try:
+            # Check and deduct happen under the user's lock; the transaction is logged
+            transaction = wallet_ledger.deduct(request.user_id, request.amount, request.game_name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        return {
+            "success": True,
+            "message": f"Deducted {request.amount} coins",
+            "new_balance": transaction["new_balance"],
+            "transaction": transaction
+        }
     
-    if balance < request.amount:
-        raise HTTPException(status_code=400, detail="Insufficient coins")
+    return run_idempotent("deduct", request, (request.amount, request.game_name), deduct)
+
+@app.post("/api/rewardCoin")
+def reward_coin(request: CoinRewardRequest):
+    """Reward coins when user wins a game (send idempotency_key to make retries safe)"""
+    def reward():
+        try:
+            transaction = wallet_ledger.reward(request.user_id, request.amount, request.game_name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        return {
+            "success": True,
+            "message": f"Rewarded {request.amount} coins",
+            "new_balance": transaction["new_balance"],
+            "transaction": transaction
+        }
+    
+    return run_idempotent("reward", request, (request.amount, request.game_name), reward)
+
+@app.post("/api/games/{game_id}/play")
+def play_round(game_id: str, request: PlayRoundRequest):
+    """
+    Play one round server side: charge the entry fee, decide the outcome and
+    pay the reward in one call. Fee and reward come from GAME_CONFIG and the
+    outcome from the probability controller, so clients can't skip the fee
+    or claim a reward they didn't win. Difficulty is the game's configured
+    one, not the client's.
+    """
+    if game_id not in GAME_CONFIG:
+        raise HTTPException(status_code=404, detail="Game not found")
+    config = GAME_CONFIG[game_id]
+    if not config["enabled"]:
+        raise HTTPException(status_code=400, detail="Game is disabled")
     
-    user_wallets[request.user_id] = balance - request.amount
+    # Not adjust_difficulty_for_player_level: it drops most players below a 50% win
+    # rate to "easy", which erases the house margin (see economySimulator.py)
+    difficulty = config.get("difficulty", "normal")
     
-    # Log transaction
-    transaction = {
-        "user_id": request.user_id,
-        "type": "deduct",
-        "amount": request.amount,
-        "game": request.game_name,
-        "timestamp": datetime.now().isoformat(),
-        "new_balance": user_wallets[request.user_id]
-    }
+    def play():
+        won = probability_controller.should_player_win(game_id, difficulty)
+        try:
+            transactions = wallet_ledger.settle_round(
+                request.user_id, game_id, config["entry_fee"], config["reward"], won
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        return {
+            "success": True,
+            "game": game_id,
+            "won": won,
+            "difficulty": difficulty,
+            "entry_fee": config["entry_fee"],
+            "reward": config["reward"] if won else 0,
+            "new_balance": transactions[-1]["new_balance"],
+            "transactions": transactions
+        }
     
-    return {
-        "success": True,
-        "message": f"Deducted {request.amount} coins",
-        "new_balance": user_wallets[request.user_id],
-        "transaction": transaction
-    }
+    return run_idempotent(f"play:{game_id}", request, None, play)
 
-@app.post("/api/rewardCoin")
-def reward_coin(request: CoinRewardRequest):
-    """Reward coins when user wins a game"""
-    balance = get_user_wallet(request.user_id)
-    user_wallets[request.user_id] = balance + request.amount
+@app.post("/api/wallet/batch")
+def wallet_batch(request: WalletBatchRequest):
+    """
+    Apply many wallet operations (tournament entry fees, bulk payouts) in one
+    all-or-nothing transaction with a single log write. If any operation
+    fails, nothing is applied and the per-operation results say which.
+    """
+    if not request.operations:
+        raise HTTPException(status_code=400, detail="No operations")
+    if len(request.operations) > WALLET_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {WALLET_BATCH_MAX} operations per batch")
     
-    # Log transaction
-    transaction = {
-        "user_id": request.user_id,
-        "type": "reward",
-        "amount": request.amount,
-        "game": request.game_name,
-        "timestamp": datetime.now().isoformat(),
-        "new_balance": user_wallets[request.user_id]
-    }
+    operations = [
+        {"user_id": op.user_id, "type": op.type, "amount": op.amount, "game": op.game_name}
+        for op in request.operations
+    ]
     
-    return {
-        "success": True,
-        "message": f"Rewarded {request.amount} coins",
-        "new_balance": user_wallets[request.user_id],
-        "transaction": transaction
-    }
+    def apply():
+        try:
+            transactions = wallet_ledger.apply_batch(operations)
+        except BatchRejected as e:
+            raise HTTPException(status_code=400, detail={"message": str(e), "results": e.results})
+        
+        return {
+            "success": True,
+            "message": f"Applied {len(transactions)} operations",
+            "results": [
+                {"index": i, "success": True, "new_balance": t["new_balance"], "transaction": t}
+                for i, t in enumerate(transactions)
+            ]
+        }
+    
+    fingerprint = tuple((op["user_id"], op["type"], op["amount"], op["game"]) for op in operations)
+    return run_idempotent("batch", request, fingerprint, apply)
 
 @app.get("/api/games/config")
 def get_game_config():
@@ -168,6 +272,37 @@ def get_all_probabilities():
         "house_edge": probability_controller.house_edge
     }
 
+@app.get("/api/probability/{game_id}/simulate")
+def simulate_game_economy(game_id: str, players: int = 10000, rounds: int = 100,
+                          starting_balance: int = 1000, difficulty: str = "adaptive",
+                          entry_fee: Optional[int] = None, reward: Optional[int] = None,
+                          seed: Optional[int] = None):
+    """
+    Monte-Carlo run of players x rounds under the current probabilities (Admin only)
+
+    Fee and reward default to the game's GAME_CONFIG values; override them
+    to try out a change before applying it. Pass a seed to reproduce a run.
+    """
+    if game_id not in GAME_CONFIG:
+        raise HTTPException(status_code=404, detail="Game not found")
+    if not economy_simulator.available():
+        raise HTTPException(status_code=503, detail="Simulation requires numpy")
+    config = GAME_CONFIG[game_id]
+    try:
+        result = economy_simulator.simulate(
+            game_id,
+            entry_fee=config["entry_fee"] if entry_fee is None else entry_fee,
+            reward=config["reward"] if reward is None else reward,
+            players=players,
+            rounds=rounds,
+            starting_balance=starting_balance,
+            difficulty=difficulty,
+            seed=seed,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, "simulation": result}
+
 @app.get("/api/probability/{game_id}")
 def get_game_probability(game_id: str, difficulty: str = "normal"):
     """Get win probability for a specific game"""
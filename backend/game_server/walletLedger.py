@@ -0,0 +1,289 @@
+"""
+Wallet Ledger
+Thread-safe coin balances with an append-only transaction log and snapshot recovery
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+class InsufficientCoins(ValueError):
+    pass
+
+
+class BatchRejected(ValueError):
+    def __init__(self, results: List[dict]):
+        super().__init__("Batch rejected; no operations were applied")
+        self.results = results
+
+
+class WalletLedger:
+    def __init__(self, data_dir: str, starting_balance: int = 1000, snapshot_every: int = 10000,
+                 fsync: bool = False, lock_stripes: int = 64):
+        """
+        Balances live in memory. Every change is appended to wallet_log.jsonl
+        before it becomes visible, and every snapshot_every changes the
+        balances are written to wallet_snapshot.json and the log is truncated.
+        On startup the snapshot is loaded and newer log records are replayed.
+
+        Args:
+            data_dir: Directory for the snapshot and log files
+            starting_balance: Balance of a wallet that has never been used
+            snapshot_every: Log records between snapshots
+            fsync: fsync the log after every record (survives power loss, slower)
+            lock_stripes: Number of per-user lock stripes
+        """
+        self.data_dir = data_dir
+        self.starting_balance = starting_balance
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.snapshot_path = os.path.join(data_dir, "wallet_snapshot.json")
+        self.log_path = os.path.join(data_dir, "wallet_log.jsonl")
+        os.makedirs(data_dir, exist_ok=True)
+
+        self.balances: Dict[str, int] = {}
+        self.seq = 0
+        self._since_snapshot = 0
+        # A user's read-check-write runs under its stripe lock; the log lock
+        # orders appends and balance updates so a snapshot sees a consistent seq
+        self._user_locks = [threading.Lock() for _ in range(lock_stripes)]
+        self._log_lock = threading.Lock()
+
+        self._recover()
+        self._log = open(self.log_path, "a", encoding="utf-8")
+
+    # ---- recovery ----
+
+    def _recover(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self.balances = snapshot["balances"]
+            self.seq = snapshot["seq"]
+
+        if not os.path.exists(self.log_path):
+            return
+        good_bytes = 0
+        with open(self.log_path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Unterminated record")
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last write from a crash
+                    break
+                good_bytes += len(line)
+                if record["seq"] > self.seq:
+                    self.balances[record["user_id"]] = record["new_balance"]
+                    self.seq = record["seq"]
+                    self._since_snapshot += 1
+        # Cut the torn tail off, or the next append would be glued onto it
+        # and lost (with everything after it) on the following recovery
+        if good_bytes < os.path.getsize(self.log_path):
+            with open(self.log_path, "r+b") as f:
+                f.truncate(good_bytes)
+
+    # ---- locking ----
+
+    def lock_for(self, user_id: str) -> threading.Lock:
+        return self._user_locks[hash(user_id) % len(self._user_locks)]
+
+    def locks_for(self, user_ids) -> List[threading.Lock]:
+        """Stripe locks covering several users, in the one global order that avoids deadlock"""
+        stripes = sorted({hash(user_id) % len(self._user_locks) for user_id in user_ids})
+        return [self._user_locks[i] for i in stripes]
+
+    # ---- log ----
+
+    def _append(self, records: List[dict]):
+        """Write records to the log and apply their balances (caller holds the log lock)"""
+        lines = []
+        for record in records:
+            self.seq += 1
+            record["seq"] = self.seq
+            lines.append(json.dumps(record))
+        self._log.write("\n".join(lines) + "\n")
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        for record in records:
+            self.balances[record["user_id"]] = record["new_balance"]
+        self._since_snapshot += len(records)
+        if self._since_snapshot >= self.snapshot_every:
+            self._snapshot()
+
+    def _snapshot(self):
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"seq": self.seq, "balances": self.balances,
+                       "timestamp": datetime.now().isoformat()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
+        # Everything in the log is now covered by the snapshot
+        self._log.close()
+        self._log = open(self.log_path, "w", encoding="utf-8")
+        self._since_snapshot = 0
+
+    def snapshot(self):
+        """Write a snapshot now and truncate the log"""
+        with self._log_lock:
+            self._snapshot()
+
+    # ---- wallet operations ----
+
+    def balance(self, user_id: str) -> int:
+        """Get a user's balance (wallets start at starting_balance)"""
+        return self.balances.get(user_id, self.starting_balance)
+
+    def _transaction(self, user_id: str, tx_type: str, amount: int, game: Optional[str],
+                     new_balance: int) -> dict:
+        return {
+            "user_id": user_id,
+            "type": tx_type,
+            "amount": amount,
+            "game": game,
+            "timestamp": datetime.now().isoformat(),
+            "new_balance": new_balance,
+        }
+
+    def deduct(self, user_id: str, amount: int, game: Optional[str] = None) -> dict:
+        """
+        Atomically remove coins from a wallet
+
+        Args:
+            user_id: Wallet owner
+            amount: Coins to remove (positive)
+            game: Game the coins are spent on
+
+        Returns:
+            The logged transaction
+
+        Raises:
+            InsufficientCoins: If the balance is lower than amount
+        """
+        if amount <= 0:
+            raise ValueError("Amount must be positive")
+        with self.lock_for(user_id):
+            balance = self.balance(user_id)
+            if balance < amount:
+                raise InsufficientCoins("Insufficient coins")
+            transaction = self._transaction(user_id, "deduct", amount, game, balance - amount)
+            with self._log_lock:
+                self._append([transaction])
+        return transaction
+
+    def reward(self, user_id: str, amount: int, game: Optional[str] = None) -> dict:
+        """
+        Atomically add coins to a wallet
+
+        Args:
+            user_id: Wallet owner
+            amount: Coins to add (positive)
+            game: Game the coins were won in
+
+        Returns:
+            The logged transaction
+        """
+        if amount <= 0:
+            raise ValueError("Amount must be positive")
+        with self.lock_for(user_id):
+            transaction = self._transaction(user_id, "reward", amount, game, self.balance(user_id) + amount)
+            with self._log_lock:
+                self._append([transaction])
+        return transaction
+
+    def settle_round(self, user_id: str, game: str, entry_fee: int, reward: int, won: bool) -> List[dict]:
+        """
+        Charge a game's entry fee and pay its reward (if won) as one atomic step
+
+        Both transactions are logged in a single write, so a round is never
+        half settled.
+
+        Args:
+            user_id: Player
+            game: Game identifier
+            entry_fee: Coins charged for the round
+            reward: Coins paid on a win
+            won: Round outcome
+
+        Returns:
+            The logged transactions (deduct, then reward if won)
+
+        Raises:
+            InsufficientCoins: If the balance is lower than entry_fee
+        """
+        with self.lock_for(user_id):
+            balance = self.balance(user_id)
+            if balance < entry_fee:
+                raise InsufficientCoins("Insufficient coins")
+            transactions = [self._transaction(user_id, "deduct", entry_fee, game, balance - entry_fee)]
+            if won and reward > 0:
+                transactions.append(self._transaction(user_id, "reward", reward, game, balance - entry_fee + reward))
+            with self._log_lock:
+                self._append(transactions)
+        return transactions
+
+    def apply_batch(self, operations: List[dict]) -> List[dict]:
+        """
+        Apply many deducts/rewards all-or-nothing, with one log write
+
+        Operations are applied in order, so a user can be paid and charged in
+        the same batch. If any operation fails, none is applied.
+
+        Args:
+            operations: Dicts with user_id, type ("deduct" or "reward"), amount and optional game
+
+        Returns:
+            The logged transaction for each operation, in order
+
+        Raises:
+            BatchRejected: With a result per operation ({"index", "success", "error"})
+        """
+        locks = self.locks_for(op["user_id"] for op in operations)
+        for lock in locks:
+            lock.acquire()
+        try:
+            balances = {}
+            transactions = []
+            results = []
+            for index, op in enumerate(operations):
+                user_id, amount = op["user_id"], op["amount"]
+                balance = balances.get(user_id, self.balance(user_id))
+                error = None
+                if op["type"] not in ("deduct", "reward"):
+                    error = f"Unknown operation type: {op['type']}"
+                elif amount <= 0:
+                    error = "Amount must be positive"
+                elif op["type"] == "deduct" and balance < amount:
+                    error = "Insufficient coins"
+                results.append({"index": index, "success": error is None, "error": error})
+                if error is None:
+                    balance += amount if op["type"] == "reward" else -amount
+                    balances[user_id] = balance
+                    transactions.append(self._transaction(user_id, op["type"], amount, op.get("game"), balance))
+            if len(transactions) < len(operations):
+                raise BatchRejected(results)
+            with self._log_lock:
+                self._append(transactions)
+            return transactions
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def close(self):
+        """Snapshot and close the log"""
+        with self._log_lock:
+            self._snapshot()
+            self._log.close()
+
+
+# Global instance
+wallet_ledger = WalletLedger(
+    os.getenv("GAME_WALLET_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")),
+    fsync=os.getenv("GAME_WALLET_FSYNC", "") == "1",
+)
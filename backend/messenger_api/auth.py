@@ -0,0 +1,157 @@
+"""
+Auth Tokens
+HMAC-signed, expiring session tokens (JWT HS256 format) and a cached token -> user resolver
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+DEFAULT_TOKEN_TTL = 7 * 24 * 3600
+
+_HEADER = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b"=")
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class TokenSigner:
+    """
+    Issues and verifies header.payload.signature tokens signed with
+    HMAC-SHA256. Claims are sub (user id), iat and exp; nothing is stored
+    server side, so any worker holding the secret can verify a token.
+    """
+
+    def __init__(self, secret: bytes, ttl: float = DEFAULT_TOKEN_TTL):
+        self.secret = secret
+        self.ttl = ttl
+
+    def _sign(self, signing_input: bytes) -> bytes:
+        return _b64encode(hmac.new(self.secret, signing_input, hashlib.sha256).digest())
+
+    def issue(self, user_id, now: Optional[float] = None) -> str:
+        now = int(now or time.time())
+        claims = {"sub": user_id, "iat": now, "exp": now + int(self.ttl)}
+        signing_input = _HEADER + b"." + _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+        return (signing_input + b"." + self._sign(signing_input)).decode("ascii")
+
+    def verify(self, token: str, now: Optional[float] = None) -> dict:
+        """Claims of a valid, unexpired token; raises InvalidToken otherwise"""
+        try:
+            signing_input, _, signature = token.encode("ascii").rpartition(b".")
+            header, _, payload = signing_input.partition(b".")
+        except (AttributeError, UnicodeEncodeError):
+            raise InvalidToken("Malformed token")
+        if header != _HEADER or not payload:
+            raise InvalidToken("Malformed token")
+        if not hmac.compare_digest(signature, self._sign(signing_input)):
+            raise InvalidToken("Bad signature")
+        try:
+            claims = json.loads(_b64decode(payload.decode("ascii")))
+        except ValueError:
+            raise InvalidToken("Malformed token")
+        if not isinstance(claims, dict) or "sub" not in claims or not isinstance(claims.get("exp"), int):
+            raise InvalidToken("Malformed token")
+        if claims["exp"] <= (now or time.time()):
+            raise InvalidToken("Token expired")
+        return claims
+
+
+class LRUCache:
+    """Small least-recently-used mapping (event-loop only, no locking)"""
+
+    def __init__(self, max_entries: int, on_evict: Optional[Callable[[object], None]] = None):
+        self.max_entries = max_entries
+        # Called with the key of each entry dropped to make room
+        self.on_evict = on_evict
+        self._entries: "OrderedDict" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            evicted, _ = self._entries.popitem(last=False)
+            if self.on_evict is not None:
+                self.on_evict(evicted)
+
+    def pop(self, key) -> None:
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class Authenticator:
+    """
+    Resolves a bearer token to the public view of its user (no password).
+    Verified tokens and user views are kept in two LRU caches, so a repeat
+    request costs two dict lookups and an expiry check; call invalidate()
+    whenever a user record changes.
+    """
+
+    def __init__(self, signer: TokenSigner, load_user: Callable[[object], Optional[dict]],
+                 cache_size: int = 10000):
+        self.signer = signer
+        self.load_user = load_user
+        # token -> (user id, exp)
+        self.tokens = LRUCache(cache_size)
+        # user id -> public user dict
+        self.users = LRUCache(cache_size)
+
+    def resolve(self, token: str) -> dict:
+        """The token's user; raises InvalidToken if the token or user is not valid"""
+        entry = self.tokens.get(token)
+        if entry is None:
+            claims = self.signer.verify(token)
+            entry = (claims["sub"], claims["exp"])
+            self.tokens.put(token, entry)
+        elif entry[1] <= time.time():
+            self.tokens.pop(token)
+            raise InvalidToken("Token expired")
+
+        user_id = entry[0]
+        user = self.users.get(user_id)
+        if user is None:
+            stored = self.load_user(user_id)
+            if stored is None:
+                raise InvalidToken("Unknown user")
+            user = {k: v for k, v in stored.items() if k != "password"}
+            self.users.put(user_id, user)
+        return user
+
+    def invalidate(self, user_id) -> None:
+        self.users.pop(user_id)
+
+    def stats(self) -> dict:
+        return {
+            "tokens": len(self.tokens),
+            "users": len(self.users),
+            "token_hits": self.tokens.hits,
+            "token_misses": self.tokens.misses,
+            "user_hits": self.users.hits,
+            "user_misses": self.users.misses,
+        }
@@ -0,0 +1,161 @@
+"""
+Blob Store
+Content-addressed, deduplicating storage for uploaded files
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import BinaryIO, Optional
+
+from io_pool import io_pool
+from uploads import StoredUpload, commit_temp, discard_temp, stream_to_temp
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobStore:
+    """
+    Files are stored once per SHA-256 digest under a sharded layout
+    (blobs/ab/cd/<digest>) and reference counted in a small SQLite index.
+    Public names are <digest><ext>; names that are not digests resolve to
+    the legacy flat upload directory so old /uploads/ URLs keep working.
+    A reference taken with an expiry (a lease, e.g. a story) is dropped by
+    release_expired() once that time has passed.
+    """
+
+    def __init__(self, upload_dir: str, index_path: str):
+        self.upload_dir = upload_dir
+        self.root = os.path.join(upload_dir, 'blobs')
+        self.temp_dir = os.path.join(upload_dir, '.incoming')
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "digest TEXT PRIMARY KEY, size INTEGER NOT NULL, refs INTEGER NOT NULL, created TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (id INTEGER PRIMARY KEY, digest TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS leases_expires ON leases (expires)")
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    @staticmethod
+    def digest_of(name: str) -> Optional[str]:
+        """The content digest a public name refers to (None for legacy names)"""
+        stem = os.path.splitext(name)[0]
+        return stem if DIGEST_RE.match(stem) else None
+
+    def locate(self, name: str) -> Optional[str]:
+        """Map a public upload name to its path on disk without touching the filesystem"""
+        digest = self.digest_of(name)
+        if digest:
+            return self.path_for(digest)
+        if name.startswith('.') or '/' in name or '\\' in name:
+            return None
+        return os.path.join(self.upload_dir, name)
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Map a public upload name to an existing file (None if missing)"""
+        path = self.locate(name)
+        return path if path and os.path.isfile(path) else None
+
+    async def put(self, source, ext: str, max_bytes: int, expires: Optional[float] = None) -> StoredUpload:
+        """
+        Stream source into the store and take a reference on its blob; with
+        expires (a time.time() value) the reference is dropped after that time
+        """
+        f, size, digest = await stream_to_temp(source, self.temp_dir, max_bytes)
+        digest = digest.hexdigest()
+        await io_pool.run(self._place, f, digest, size, expires)
+        name = f"{digest}{ext}"
+        return StoredUpload(name, self.path_for(digest), size, digest)
+
+    async def put_file(self, f: BinaryIO, digest: str, size: int) -> str:
+        """Adopt an already-written temp file whose digest is known"""
+        await io_pool.run(self._place, f, digest, size)
+        return self.path_for(digest)
+
+    def _place(self, f: BinaryIO, digest: str, size: int, expires: Optional[float] = None) -> None:
+        path = self.path_for(digest)
+        if not os.path.exists(path):
+            # Sync outside the lock so commit_temp's fsync under it has nothing left to write
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            # Decided under the lock: releasing the last reference deletes the file under it
+            if os.path.exists(path):
+                discard_temp(f)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                commit_temp(f, path)
+            self._conn.execute(
+                "INSERT INTO blobs (digest, size, refs, created) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT(digest) DO UPDATE SET refs = refs + 1",
+                (digest, size, datetime.now().isoformat()),
+            )
+            if expires is not None:
+                self._conn.execute("INSERT INTO leases (digest, expires) VALUES (?, ?)", (digest, expires))
+
+    def refs(self, digest: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT refs FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        return row[0] if row else 0
+
+    def _drop_ref(self, digest: str) -> Optional[int]:
+        """Drop one reference (caller holds the lock); returns the refs left, None for unknown blobs"""
+        self._conn.execute("UPDATE blobs SET refs = refs - 1 WHERE digest = ? AND refs > 0", (digest,))
+        row = self._conn.execute("SELECT refs FROM blobs WHERE digest = ?", (digest,)).fetchone()
+        if row is not None and row[0] == 0:
+            self._conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        return row[0] if row else None
+
+    def _remove(self, digest: str) -> None:
+        try:
+            os.remove(self.path_for(digest))
+        except OSError:
+            pass
+
+    def release(self, digest: str) -> int:
+        """Drop one reference; the file is deleted when the last one goes (blocking)"""
+        with self._lock:
+            refs = self._drop_ref(digest)
+            if refs == 0:
+                self._remove(digest)
+        return refs or 0
+
+    def release_expired(self, now: Optional[float] = None) -> int:
+        """
+        Drop the references of leases whose expiry has passed, deleting blobs
+        left with none (blocking); returns the number of leases ended
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            # IMMEDIATE: workers sharing the index must not end the same lease twice
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                expired = self._conn.execute("SELECT id, digest FROM leases WHERE expires <= ?", (now,)).fetchall()
+                gone = []
+                for lease_id, digest in expired:
+                    self._conn.execute("DELETE FROM leases WHERE id = ?", (lease_id,))
+                    if self._drop_ref(digest) == 0:
+                        gone.append(digest)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            # After COMMIT: a crash in between leaves an orphaned file, never a missing one
+            for digest in gone:
+                self._remove(digest)
+        return len(expired)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,237 @@
+"""
+Message Bus
+Cross-worker fan-out so a frame published on one uvicorn worker reaches rooms on all of them
+"""
+
+import asyncio
+import os
+import socket
+import struct
+from typing import Callable, Optional, Set, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the tcp: address is usable there
+    fcntl = None
+
+Frame = Union[str, bytes]
+Deliver = Callable[[str, Frame], object]
+
+# length (payload after this header), kind (0 = text, 1 = binary), room length
+HEADER = struct.Struct('>IBH')
+MAX_BUFFERED = 64 * 1024 * 1024
+
+
+def encode_frame(room: str, frame: Frame) -> bytes:
+    room_bytes = room.encode('utf-8')
+    if isinstance(frame, bytes):
+        kind, payload = 1, frame
+    else:
+        kind, payload = 0, frame.encode('utf-8')
+    return HEADER.pack(len(room_bytes) + len(payload), kind, len(room_bytes)) + room_bytes + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[bytes, str, Frame]:
+    """Read one frame; returns (raw bytes, room, frame)"""
+    header = await reader.readexactly(HEADER.size)
+    length, kind, room_length = HEADER.unpack(header)
+    body = await reader.readexactly(length)
+    room = body[:room_length].decode('utf-8')
+    payload = body[room_length:]
+    frame = payload if kind == 1 else payload.decode('utf-8')
+    return header + body, room, frame
+
+
+class MessageBus:
+    """Interface: publish(room, frame) calls deliver(room, frame) on every worker"""
+
+    def __init__(self):
+        self.deliver: Optional[Deliver] = None
+        self.published = 0
+        self.received = 0
+
+    async def start(self, deliver: Deliver) -> None:
+        self.deliver = deliver
+
+    async def publish(self, room: str, frame: Frame) -> None:
+        raise NotImplementedError
+
+    async def stop(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"type": type(self).__name__, "published": self.published, "received": self.received}
+
+
+class InMemoryBus(MessageBus):
+    """Single-process bus: publishing delivers straight to the local hub"""
+
+    async def publish(self, room: str, frame: Frame) -> None:
+        self.published += 1
+        self.received += 1
+        self.deliver(room, frame)
+
+
+class SocketBus(MessageBus):
+    """
+    Local IPC bus over a unix socket (or loopback TCP where unix sockets are missing)
+
+    The first worker to start binds the address and runs a small broker that
+    relays every frame to every connected worker, itself included. If the
+    broker's worker exits, the others reconnect and one of them takes over.
+    Frames published while the link is down are delivered locally only.
+    """
+
+    def __init__(self, address: str, reconnect_delay: float = 0.5):
+        super().__init__()
+        self.address = address
+        self.reconnect_delay = reconnect_delay
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+        self._peer_tasks: Set[asyncio.Task] = set()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock_file = None
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+        self.is_broker = False
+
+    async def start(self, deliver: Deliver) -> None:
+        await super().start(deliver)
+        await self._connect()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            if self._peer_tasks:
+                # Closing the transports ends each handler's read loop
+                await asyncio.wait(self._peer_tasks, timeout=1.0)
+            await self._server.wait_closed()
+            if self.address.startswith('unix:'):
+                try:
+                    os.unlink(self.address[5:])
+                except OSError:
+                    pass
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    async def publish(self, room: str, frame: Frame) -> None:
+        self.published += 1
+        if self._writer is None or self._writer.is_closing() or not self._connected.is_set():
+            self.received += 1
+            self.deliver(room, frame)
+            return
+        self._writer.write(encode_frame(room, frame))
+        await self._writer.drain()
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "address": self.address,
+            "broker": self.is_broker,
+            "peers": len(self._peers),
+            "connected": self._connected.is_set(),
+        }
+
+    # ---- client side ----
+
+    async def _open(self):
+        kind, _, target = self.address.partition(':')
+        if kind == 'unix':
+            return await asyncio.open_unix_connection(target)
+        host, _, port = target.rpartition(':')
+        return await asyncio.open_connection(host, int(port))
+
+    async def _connect(self) -> None:
+        while True:
+            try:
+                self._reader, self._writer = await self._open()
+                self._connected.set()
+                return
+            except OSError:
+                pass
+            try:
+                await self._serve()
+            except OSError:
+                # Another worker won the race to bind; try connecting again
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                while True:
+                    _, room, frame = await read_frame(self._reader)
+                    self.received += 1
+                    self.deliver(room, frame)
+            except (asyncio.IncompleteReadError, OSError):
+                pass
+            self._connected.clear()
+            self._writer.close()
+            self._writer = None
+            await asyncio.sleep(self.reconnect_delay)
+            await self._connect()
+
+    # ---- broker side ----
+
+    async def _serve(self) -> None:
+        kind, _, target = self.address.partition(':')
+        if kind == 'unix':
+            if fcntl is None or not hasattr(socket, 'AF_UNIX'):
+                raise RuntimeError("unix sockets are not available here; use a tcp: bus address")
+            # Whoever holds the lock is the broker; flock raises OSError for everyone else
+            # and is released by the OS if the broker's worker dies
+            lock_file = open(target + '.lock', 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise
+            self._lock_file = lock_file
+            if os.path.exists(target):
+                # Left behind by a broker that died
+                os.unlink(target)
+            self._server = await asyncio.start_unix_server(self._handle_peer, target)
+        else:
+            host, _, port = target.rpartition(':')
+            self._server = await asyncio.start_server(self._handle_peer, host, int(port))
+        self.is_broker = True
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._peers.add(writer)
+        self._peer_tasks.add(asyncio.current_task())
+        try:
+            while True:
+                raw, _, _ = await read_frame(reader)
+                for peer in list(self._peers):
+                    if peer.transport.get_write_buffer_size() > MAX_BUFFERED:
+                        # A worker that can't keep up is cut off rather than stalling the rest
+                        self._peers.discard(peer)
+                        peer.close()
+                        continue
+                    peer.write(raw)
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            self._peer_tasks.discard(asyncio.current_task())
+            writer.close()
+
+
+def create_bus(kind: str, address: Optional[str] = None) -> MessageBus:
+    if kind == 'socket':
+        if address is None:
+            address = 'unix:/tmp/messenger-bus.sock' if hasattr(socket, 'AF_UNIX') else 'tcp:127.0.0.1:8765'
+        return SocketBus(address)
+    return InMemoryBus()
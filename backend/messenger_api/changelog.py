@@ -0,0 +1,208 @@
+"""
+Change Log
+Global, sequence-numbered log of message, read-receipt and profile changes for delta sync
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from io_pool import io_pool
+from writer import GroupCommitter
+
+# Change kinds (kept to one letter: they are repeated in every sync entry)
+MESSAGE = "m"   # new or edited message, data = the message
+RECEIPT = "r"   # read receipt, data = {"userId", "seq"}
+PROFILE = "p"   # profile change, data = the public profile
+
+DEFAULT_SYNC_LIMIT = 500
+MAX_SYNC_LIMIT = 2000
+
+
+def conversation_scope(conversation_id: str) -> str:
+    return f"c:{conversation_id}"
+
+
+def user_scope(user_id) -> str:
+    return f"u:{user_id}"
+
+
+class ChangeLog:
+    """
+    Every change gets the next global seq, which is also the client's sync
+    cursor. Seqs are assigned inside the write transaction, which holds the
+    database write lock, so processes sharing the file never hand out the same
+    seq and seqs become visible in order. Entries older than the retention
+    window are truncated; a client whose cursor falls behind the truncation
+    point is told to reset (refetch).
+
+    Stores whose data lives in the same database (MessageStore) add their
+    entries with write() inside their own write transaction, so a change and
+    its log entry are committed together.
+    """
+
+    def __init__(self, path: str, retention: float = 7 * 24 * 3600, commit_window: float = 0.005):
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS changes ("
+            "seq INTEGER PRIMARY KEY, scope TEXT NOT NULL, kind TEXT NOT NULL, "
+            "entity TEXT NOT NULL, data TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS changes_scope ON changes (scope, seq)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS changelog_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        self.writer = GroupCommitter(self._write_rows, window=commit_window)
+
+    def connection(self) -> Tuple[threading.Lock, sqlite3.Connection]:
+        """The log's own (lock, connection), for a ':memory:' store that can't open the database again"""
+        return self._lock, self._conn
+
+    @staticmethod
+    def _floor(conn: sqlite3.Connection) -> int:
+        """Seqs at or below the floor have been truncated"""
+        row = conn.execute("SELECT value FROM changelog_meta WHERE key = 'floor'").fetchone()
+        return row[0] if row else 0
+
+    @classmethod
+    def _high(cls, conn: sqlite3.Connection) -> int:
+        """Highest seq ever assigned"""
+        row = conn.execute("SELECT MAX(seq) FROM changes").fetchone()
+        return max(row[0] or 0, cls._floor(conn))
+
+    @property
+    def floor(self) -> int:
+        with self._lock:
+            return self._floor(self._conn)
+
+    @staticmethod
+    def _row(scope: str, kind: str, entity, data: dict, created: float) -> list:
+        return [None, scope, kind, str(entity), json.dumps(data, ensure_ascii=False), created]
+
+    def _insert(self, conn: sqlite3.Connection, rows: List[list]) -> None:
+        """Fill in each row's seq and insert the rows (inside a BEGIN IMMEDIATE on conn)"""
+        seq = self._high(conn)
+        for row in rows:
+            seq += 1
+            row[0] = seq
+        conn.executemany(
+            "INSERT INTO changes (seq, scope, kind, entity, data, created) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def write(self, conn: sqlite3.Connection, changes: Iterable[tuple]) -> List[int]:
+        """
+        Append (scope, kind, entity, data) changes through conn, as part of the
+        caller's transaction on the same database
+
+        The caller must have begun it with BEGIN IMMEDIATE, so the write lock
+        is already held when the seqs are read. Returns the seqs.
+        """
+        now = time.time()
+        rows = [self._row(*change, now) for change in changes]
+        self._insert(conn, rows)
+        return [row[0] for row in rows]
+
+    def _write_rows(self, rows: List[list]) -> None:
+        """Rows are [None, scope, kind, entity, data, created]; fills in each seq"""
+        with self._lock:
+            # IMMEDIATE takes the write lock before the MAX(seq) read
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._insert(self._conn, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _query(self, scopes: List[str], cursor: int, limit: int) -> Tuple[int, int, List[tuple]]:
+        """(floor, high, rows), all read from one snapshot"""
+        marks = ",".join("?" * len(scopes))
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                floor, high = self._floor(self._conn), self._high(self._conn)
+                rows = []
+                if cursor >= floor and scopes:
+                    rows = self._conn.execute(
+                        f"SELECT seq, kind, entity, data FROM changes WHERE scope IN ({marks}) "
+                        "AND seq > ? ORDER BY seq LIMIT ?",
+                        (*scopes, cursor, limit),
+                    ).fetchall()
+            finally:
+                self._conn.execute("COMMIT")
+        return floor, high, rows
+
+    async def record(self, scope: str, kind: str, entity, data: dict) -> int:
+        """Append one change and wait until it is durable; returns its seq"""
+        return (await self.record_many([(scope, kind, entity, data)]))[0]
+
+    async def record_many(self, changes: Iterable[tuple]) -> List[int]:
+        """Append (scope, kind, entity, data) changes in one commit; returns their seqs"""
+        now = time.time()
+        rows = [self._row(*change, now) for change in changes]
+        # Seqs are unknown until the flush, so key each row by identity
+        await self.writer.commit_many([(id(row), row) for row in rows])
+        return [row[0] for row in rows]
+
+    async def since(self, scopes: List[str], cursor: int, limit: int = DEFAULT_SYNC_LIMIT) -> dict:
+        """
+        Changes after cursor in the given scopes
+
+        Entries are compacted so each entity appears once with its latest state,
+        and encoded as [seq, kind, entity, data] arrays.
+        """
+        limit = max(1, min(limit, MAX_SYNC_LIMIT))
+        floor, high, rows = await io_pool.run(self._query, scopes, cursor, limit + 1)
+        if cursor < floor:
+            return {"reset": True, "cursor": high, "changes": [], "hasMore": False}
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        latest = {}
+        for seq, kind, entity, data in rows:
+            latest[(kind, entity)] = [seq, kind, entity, json.loads(data)]
+        changes = sorted(latest.values(), key=lambda change: change[0])
+        # Without more pages the client is current up to the newest seq, even if
+        # the last changes were outside its scopes
+        next_cursor = rows[-1][0] if has_more else max(high, cursor)
+        return {"reset": False, "cursor": next_cursor, "changes": changes, "hasMore": has_more}
+
+    def truncate(self, now: Optional[float] = None) -> int:
+        """Drop changes older than the retention window (blocking); returns rows removed"""
+        cutoff = (now or time.time()) - self.retention
+        with self._lock:
+            # One transaction, so a writer never sees the rows gone before the floor moved
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT MAX(seq) FROM changes WHERE created < ?", (cutoff,)).fetchone()
+                if not row[0]:
+                    self._conn.execute("COMMIT")
+                    return 0
+                cursor = self._conn.execute("DELETE FROM changes WHERE seq <= ?", (row[0],))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO changelog_meta (key, value) VALUES ('floor', ?)",
+                    (max(self._floor(self._conn), row[0]),),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return cursor.rowcount
+
+    async def start(self) -> None:
+        await self.writer.start()
+
+    async def stop(self) -> None:
+        await self.writer.stop()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,162 @@
+"""
+Websocket Hub
+Room-based pub/sub fan-out with a bounded send queue and writer task per connection
+"""
+
+import asyncio
+from typing import Dict, Optional, Set, Union
+
+from fastapi import WebSocket
+
+from wire import JSON, Broadcast, Codec
+
+DEFAULT_ROOM = "lobby"
+
+# What to do when a connection's send queue is full
+DROP_OLDEST = "drop_oldest"  # discard the oldest queued frame, keep the newest
+DISCONNECT = "disconnect"    # close the slow consumer
+
+
+class Connection:
+    """One websocket; frames are queued by publishers and sent by the writer task"""
+
+    def __init__(self, websocket: WebSocket, max_queue: int, policy: str, codec: Codec = JSON):
+        self.websocket = websocket
+        self.policy = policy
+        self.codec = codec
+        self.rooms: Set[str] = set()
+        self.queue: "asyncio.Queue[Union[str, bytes]]" = asyncio.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.closed = False
+        # Presence bookkeeping (see presence.py); monotonic timestamps
+        self.user_id: Optional[str] = None
+        self.status = "online"
+        self.last_seen = 0.0
+        self.last_active = 0.0
+        self.pinged = 0.0
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._writer = asyncio.create_task(self._run())
+
+    def send(self, frame: Union[str, bytes]) -> bool:
+        """Queue a frame without waiting; returns False if it was not queued"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        self.dropped += 1
+        if self.policy == DROP_OLDEST:
+            self.queue.get_nowait()
+            self.queue.put_nowait(frame)
+            return True
+        self.close()
+        return False
+
+    def reply(self, obj) -> bool:
+        """Encode a frame for this connection alone with its negotiated codec and queue it"""
+        return self.send(self.codec.encode(obj))
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer is not None:
+            self._writer.cancel()
+        asyncio.ensure_future(self._close_socket())
+
+    async def _close_socket(self) -> None:
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                frame = await self.queue.get()
+                if isinstance(frame, bytes):
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            self.close()
+
+
+class Hub:
+    """
+    Tracks which connections are in which room; publishing costs O(room size)
+    queue puts plus one encode per codec in use in the room
+    """
+
+    def __init__(self, max_queue: int = 256, policy: str = DISCONNECT):
+        self.max_queue = max_queue
+        self.policy = policy
+        self.rooms: Dict[str, Set[Connection]] = {}
+        self.connections: Set[Connection] = set()
+        self.published = 0
+        self.delivered = 0
+        self.slow_disconnects = 0
+        self.encodes = 0
+
+    def register(self, websocket: WebSocket, codec: Codec = JSON) -> Connection:
+        conn = Connection(websocket, self.max_queue, self.policy, codec)
+        conn.start()
+        self.connections.add(conn)
+        self.join(conn, DEFAULT_ROOM)
+        return conn
+
+    def unregister(self, conn: Connection) -> None:
+        for room in list(conn.rooms):
+            self.leave(conn, room)
+        self.connections.discard(conn)
+        conn.close()
+
+    def join(self, conn: Connection, room: str) -> None:
+        self.rooms.setdefault(room, set()).add(conn)
+        conn.rooms.add(room)
+
+    def leave(self, conn: Connection, room: str) -> None:
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(conn)
+            if not members:
+                del self.rooms[room]
+        conn.rooms.discard(room)
+
+    def publish(self, room: str, frame: Union[str, bytes]) -> int:
+        """Queue a frame for every connection in the room; returns how many accepted it"""
+        self.published += 1
+        delivered = 0
+        broadcast = Broadcast(frame)
+        for conn in list(self.rooms.get(room, ())):
+            if conn.send(broadcast.encoded(conn.codec)):
+                delivered += 1
+            elif conn.closed:
+                self.slow_disconnects += 1
+                self.unregister(conn)
+        self.delivered += delivered
+        self.encodes += broadcast.encodes
+        return delivered
+
+    def stats(self) -> dict:
+        codecs = {}
+        for conn in self.connections:
+            codecs[conn.codec.name] = codecs.get(conn.codec.name, 0) + 1
+        return {
+            "connections": len(self.connections),
+            "codecs": codecs,
+            "encodes": self.encodes,
+            "rooms": len(self.rooms),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": sum(c.dropped for c in self.connections),
+            "slow_disconnects": self.slow_disconnects,
+            "policy": self.policy,
+        }
@@ -0,0 +1,115 @@
+"""
+I/O Pool
+Runs blocking file and storage calls off the event loop on a bounded thread pool
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+
+class IOPool:
+    """Bounded thread pool with queue-depth accounting"""
+
+    def __init__(self, max_workers: int = 8, name: str = "messenger-io"):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.peak_queued = 0
+        self.peak_wait = 0.0
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the pool and await its result"""
+        with self._lock:
+            self.submitted += 1
+            self.peak_queued = max(self.peak_queued, self.submitted - self.started)
+        call = partial(self._call, time.perf_counter(), fn, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    def _call(self, queued_at: float, fn: Callable, *args, **kwargs):
+        wait = time.perf_counter() - queued_at
+        with self._lock:
+            self.started += 1
+            self.peak_wait = max(self.peak_wait, wait)
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self.completed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "queued": self.submitted - self.started,
+                "active": self.started - self.completed,
+                "completed": self.completed,
+                "failed": self.failed,
+                "peak_queued": self.peak_queued,
+                "peak_wait_ms": round(self.peak_wait * 1000, 3),
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+class LoopLagMonitor:
+    """Samples how late the event loop wakes up a timer (a direct measure of blocking)"""
+
+    def __init__(self, interval: float = 0.1, samples: int = 600):
+        self.interval = interval
+        self._samples = deque(maxlen=samples)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self._samples.append(max(0.0, loop.time() - expected))
+
+    def stats(self) -> dict:
+        samples = sorted(self._samples)
+        if not samples:
+            return {"samples": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+
+        def pct(p: float) -> float:
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+
+        return {
+            "samples": len(samples),
+            "p50_ms": pct(0.50),
+            "p99_ms": pct(0.99),
+            "max_ms": round(samples[-1] * 1000, 3),
+        }
+
+
+# Global instances
+io_pool = IOPool(max_workers=int(os.getenv('MESSENGER_IO_WORKERS', '8')))
+loop_lag = LoopLagMonitor()
@@ -1,17 +1,89 @@
-﻿from fastapi import FastAPI, WebSocket, UploadFile, File, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse
+﻿from fastapi import FastAPI, WebSocket, UploadFile, File, HTTPException, Request, Depends, Header
+from fastapi.responses import HTMLResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+import asyncio
+import json
 import uuid
 import os
-import json
-import hashlib
+import mimetypes
+import sys
+import secrets
+import time
 from datetime import datetime
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+
+# Allow both `uvicorn main:app` (from this folder) and `uvicorn messenger_api.main:app`
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# backend/ holds modules shared with the Flask app (ratelimit)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from io_pool import io_pool, loop_lag
+from auth import Authenticator, InvalidToken, TokenSigner
+from passwords import HasherOverloaded, PasswordHasher
+from user_views import UserViews, envelope, parse_fields, project
+from messages import DEFAULT_PAGE, MessageStore
+from storage import DuplicateUserError, MemoryBackend, SQLiteBackend, UserStore
+from blobs import BlobStore
+from changelog import DEFAULT_SYNC_LIMIT, PROFILE, ChangeLog, conversation_scope, user_scope
+from bus import create_bus
+from wire import JSON, negotiate
+from hub import DEFAULT_ROOM, Hub
+from presence import Presence
+from multipart import MultipartUploads, RequestBody, UploadSessionNotFound
+from static_files import IMMUTABLE, REVALIDATE, serve_file
+from uploads import ASGIBodyLimit, UploadTooLarge
+from ratelimit import ASGIRateLimit, RateLimiter, parse_limit, parse_rules, retry_after_header
 
 app = FastAPI(title="Messenger API (dev)")
 
+# Token-bucket rate limits per route ("<METHOD> <path> <count>/<period> [ip|account]";
+# see ratelimit.py). Account limits key on the bearer token's user, else the client IP
+RATE_LIMITS = os.getenv('MESSENGER_RATE_LIMITS', """
+    POST /auth/login 10/min ip
+    POST /auth/signup 5/min ip
+    POST /upload 30/min account
+    POST /attachments/upload 30/min account
+    POST /stories/upload 30/min account
+    POST /attachments/uploads 30/min account
+    PUT /attachments/uploads/* 600/min account
+""")
+# Failed-or-not login attempts per login name, whichever IPs they come from
+LOGIN_ACCOUNT_LIMIT = parse_limit(os.getenv('MESSENGER_LOGIN_ACCOUNT_LIMIT', '10/15min'))
+
+def token_account(authorization: str) -> Optional[str]:
+    """Rate-limit key for account rules: the user id of a valid bearer token"""
+    try:
+        return str(authenticator.resolve(authorization.partition(' ')[2].strip())["id"])
+    except InvalidToken:
+        return None
+
+rate_limiter = RateLimiter(
+    parse_rules(RATE_LIMITS),
+    identify=token_account,
+    trust_proxy=int(os.getenv('MESSENGER_TRUST_PROXY') or '0'),
+)
+
+# Added before CORS so CORS stays outermost and 429 responses carry its headers
+app.add_middleware(ASGIRateLimit, limiter=rate_limiter)
+
+# Per-route upload size limits
+MB = 1024 * 1024
+UPLOAD_LIMITS = {
+    "upload": int(os.getenv('MESSENGER_MAX_UPLOAD_MB', '25')) * MB,
+    "attachment": int(os.getenv('MESSENGER_MAX_ATTACHMENT_MB', '100')) * MB,
+    "story": int(os.getenv('MESSENGER_MAX_STORY_MB', '50')) * MB,
+    "multipart": int(os.getenv('MESSENGER_MAX_MULTIPART_MB', '1024')) * MB,
+}
+
+# Oversized form uploads get 413 before the body is parsed and spooled; added before CORS too
+app.add_middleware(ASGIBodyLimit, limits={
+    ('POST', '/upload'): UPLOAD_LIMITS["upload"],
+    ('POST', '/attachments/upload'): UPLOAD_LIMITS["attachment"],
+    ('POST', '/stories/upload'): UPLOAD_LIMITS["story"],
+})
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -20,12 +92,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-UPLOAD_DIR = os.path.join(os.path.dirname(__file__), 'uploads')
+UPLOAD_DIR = os.getenv('MESSENGER_UPLOAD_DIR', os.path.join(os.path.dirname(__file__), 'uploads'))
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Database file
+# Pre-blob uploads have random (not content-hashed) names, so cache them for a day only
+LEGACY_UPLOAD_CACHE = "public, max-age=86400"
+
+# Delta-sync change log entries are kept this long; older cursors must resync from scratch
+CHANGELOG_RETENTION = float(os.getenv('MESSENGER_CHANGELOG_RETENTION_HOURS', '168')) * 3600
+
+# Resumable upload sessions expire after this many hours
+UPLOAD_SESSION_TTL = float(os.getenv('MESSENGER_UPLOAD_SESSION_TTL_HOURS', '24')) * 3600
+
+# Stories expire after this many hours; their blob is deleted unless something else references it
+STORY_TTL = float(os.getenv('MESSENGER_STORY_TTL_HOURS', '24')) * 3600
+
+# Most ids accepted by one GET /users list request
+USERS_LIST_MAX = int(os.getenv('MESSENGER_USERS_LIST_MAX', '100'))
+
+# Legacy JSON database file (imported into the store on first boot)
 DB_FILE = os.path.join(os.path.dirname(__file__), 'users_db.json')
 
+# Storage backend: "sqlite" (default) or "memory"
+STORAGE_BACKEND = os.getenv('MESSENGER_STORAGE', 'sqlite')
+STORE_FILE = os.getenv('MESSENGER_DB', os.path.join(os.path.dirname(__file__), 'messenger.db'))
+
+# Writes arriving within this window are flushed to storage in one transaction
+COMMIT_WINDOW = float(os.getenv('MESSENGER_COMMIT_WINDOW_MS', '5')) / 1000
+
 # Static SPA directory
 STATIC_DIR = os.path.join(os.path.dirname(__file__), 'static')
 os.makedirs(STATIC_DIR, exist_ok=True)
@@ -33,33 +127,111 @@ os.makedirs(STATIC_DIR, exist_ok=True)
 # Mount static files
 app.mount('/static', StaticFiles(directory=STATIC_DIR), name='static')
 
-# Simple in-memory connections for demo
-connections = set()
+# Websocket rooms: each connection gets a bounded send queue; when it fills up the
+# slow client is either disconnected or loses its oldest queued frames
+hub = Hub(
+    max_queue=int(os.getenv('MESSENGER_WS_QUEUE', '256')),
+    policy=os.getenv('MESSENGER_WS_SLOW_POLICY', 'disconnect'),
+)
+
+# Cross-worker fan-out: "memory" (single worker) or "socket" (all workers on this box)
+bus = create_bus(os.getenv('MESSENGER_BUS', 'memory'), os.getenv('MESSENGER_BUS_ADDRESS'))
+
+# Online/away/typing, coalesced per room and sent through the bus; identified
+# connections silent for MESSENGER_WS_DEAD_TIMEOUT seconds are dropped
+presence = Presence(
+    hub,
+    bus.publish,
+    window=float(os.getenv('MESSENGER_PRESENCE_WINDOW_MS', '250')) / 1000,
+    idle_timeout=float(os.getenv('MESSENGER_IDLE_TIMEOUT', '300')),
+    dead_timeout=float(os.getenv('MESSENGER_WS_DEAD_TIMEOUT', '60')),
+)
 
 # ==================== DATABASE FUNCTIONS ====================
-def load_db():
-    """Load users database from JSON file"""
-    if os.path.exists(DB_FILE):
-        with open(DB_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {"users": [], "next_id": 10001}
-
-def save_db(db):
-    """Save users database to JSON file"""
-    with open(DB_FILE, 'w', encoding='utf-8') as f:
-        json.dump(db, f, indent=2, ensure_ascii=False)
-
-def hash_password(password: str) -> str:
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def generate_user_id():
+def open_store() -> UserStore:
+    """Open the configured storage backend, migrating users_db.json if needed"""
+    if STORAGE_BACKEND == 'memory':
+        return UserStore(MemoryBackend(), legacy_json=DB_FILE, commit_window=COMMIT_WINDOW)
+    return UserStore(SQLiteBackend(STORE_FILE), legacy_json=DB_FILE, commit_window=COMMIT_WINDOW)
+
+store = open_store()
+
+def token_secret() -> bytes:
+    """MESSENGER_TOKEN_SECRET, else a random secret generated once and kept in the store"""
+    secret = os.getenv('MESSENGER_TOKEN_SECRET')
+    if secret:
+        return secret.encode()
+    # Workers booting together each propose one; the first stored wins and all read it back
+    return store.backend.setdefault_meta('token_secret', secrets.token_hex(32)).encode()
+
+# Stateless session tokens; verified tokens and user views are cached per worker
+authenticator = Authenticator(
+    TokenSigner(token_secret(), ttl=float(os.getenv('MESSENGER_TOKEN_TTL_HOURS', '168')) * 3600),
+    store.get,
+)
+blob_store = BlobStore(UPLOAD_DIR, ':memory:' if STORAGE_BACKEND == 'memory' else STORE_FILE)
+changelog = ChangeLog(':memory:' if STORAGE_BACKEND == 'memory' else STORE_FILE,
+                      retention=CHANGELOG_RETENTION, commit_window=COMMIT_WINDOW)
+message_store = MessageStore(':memory:' if STORAGE_BACKEND == 'memory' else STORE_FILE,
+                             commit_window=COMMIT_WINDOW, changelog=changelog)
+multipart_uploads = MultipartUploads(UPLOAD_DIR, blob_store, ttl=UPLOAD_SESSION_TTL,
+                                     max_bytes=UPLOAD_LIMITS["multipart"])
+
+# Long-running tasks started with the app and cancelled on shutdown
+background_tasks = []
+
+DUPLICATE_DETAILS = {
+    "email": "Email already registered",
+    "phone": "Phone already registered",
+    "idNumber": "ID number already registered",
+}
+
+# Password KDF: cost and how many hashes may run / wait at once (the rest get a 503)
+password_hasher = PasswordHasher(
+    algorithm=os.getenv('MESSENGER_PASSWORD_ALGORITHM', 'scrypt'),
+    scrypt_n=int(os.getenv('MESSENGER_SCRYPT_N', str(2 ** 14))),
+    pbkdf2_iterations=int(os.getenv('MESSENGER_PBKDF2_ITERATIONS', '600000')),
+    max_workers=int(os.getenv('MESSENGER_PASSWORD_WORKERS', str(max(1, (os.cpu_count() or 2) // 2)))),
+    max_pending=int(os.getenv('MESSENGER_PASSWORD_QUEUE', '64')),
+)
+
+async def hash_password(password: str) -> str:
+    """Hash a password with the configured KDF off the event loop"""
+    try:
+        return await password_hasher.hash(password)
+    except HasherOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '1'})
+
+# Pre-encoded public profiles, keyed by (user id, record version, fields)
+user_views = UserViews(store)
+
+def user_json(user_id, fields=None, own=False, **extra) -> Response:
+    """JSON response of extra plus "user" (the cached profile; own=True for the user's own full record)"""
+    return Response(envelope("user", user_views.encoded(user_id, fields, own), **extra),
+                    media_type="application/json")
+
+async def current_user(authorization: Optional[str] = Header(None)) -> dict:
+    """Dependency: the user named by the Authorization: Bearer token (public fields only)"""
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise HTTPException(status_code=401, detail='Not authenticated',
+                            headers={'WWW-Authenticate': 'Bearer'})
+    try:
+        return authenticator.resolve(token.strip())
+    except InvalidToken as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={'WWW-Authenticate': 'Bearer'})
+
+async def generate_user_id():
     """Generate unique user ID"""
-    db = load_db()
-    user_id = db.get("next_id", 10001)
-    db["next_id"] = user_id + 1
-    save_db(db)
-    return user_id
+    return await store.allocate_id()
+
+async def store_upload(file: UploadFile, route: str, expires: Optional[float] = None):
+    """Stream an uploaded file into the blob store under the route's size limit"""
+    ext = os.path.splitext(file.filename)[1]
+    try:
+        return await blob_store.put(file, ext, UPLOAD_LIMITS[route], expires=expires)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
 def generate_id_number(user_id: int) -> str:
     """Generate ID number like FWP123ABC"""
@@ -87,21 +259,32 @@ class UpdateProfileRequest(BaseModel):
     profilePic: Optional[str] = None
     profileBackground: Optional[str] = None
 
+class EditMessageRequest(BaseModel):
+    content: str
+
+class ReadReceiptRequest(BaseModel):
+    seq: int
+
+class BatchSendRequest(BaseModel):
+    messages: List[dict]
+
+class InitiateUploadRequest(BaseModel):
+    fileName: str
+    mimeType: Optional[str] = None
+    size: Optional[int] = None
+
 # ==================== AUTH ENDPOINTS ====================
 @app.post('/auth/signup')
 async def auth_signup(req: SignupRequest):
     """Create new user account"""
-    db = load_db()
-    
     # Check if email/phone already exists
-    for user in db["users"]:
-        if req.email and user.get("email") == req.email:
-            raise HTTPException(status_code=400, detail="Email already registered")
-        if req.phone and user.get("phone") == req.phone:
-            raise HTTPException(status_code=400, detail="Phone already registered")
+    if store.find_by("email", req.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    if store.find_by("phone", req.phone):
+        raise HTTPException(status_code=400, detail="Phone already registered")
     
     # Generate unique user ID
-    user_id = generate_user_id()
+    user_id = await generate_user_id()
     id_number = generate_id_number(user_id)
     
     # Create new user
@@ -111,7 +294,7 @@ async def auth_signup(req: SignupRequest):
         "name": req.name,
         "email": req.email,
         "phone": req.phone,
-        "password": hash_password(req.password),
+        "password": await hash_password(req.password),
         "dob": req.dob,
         "gender": req.gender,
         "bio": "Write a short bio...",
@@ -128,76 +311,61 @@ async def auth_signup(req: SignupRequest):
         "createdAt": datetime.now().isoformat()
     }
     
-    db["users"].append(new_user)
-    save_db(db)
-    
-    # Remove password from response
-    user_response = {k: v for k, v in new_user.items() if k != 'password'}
+    try:
+        await store.insert(new_user)
+    except DuplicateUserError as e:
+        raise HTTPException(status_code=400, detail=DUPLICATE_DETAILS.get(e.field, str(e)))
     
-    # Generate token (simple UUID for now)
-    token = str(uuid.uuid4())
+    token = authenticator.signer.issue(user_id)
     
-    return {
-        "ok": True,
-        "message": f"Account created successfully! Your ID: {id_number}",
-        "user": user_response,
-        "token": token
-    }
+    return user_json(
+        user_id,
+        own=True,
+        ok=True,
+        message=f"Account created successfully! Your ID: {id_number}",
+        token=token
+    )
 
 @app.post('/auth/login')
 async def auth_login(req: LoginRequest):
     """Login with email/phone and password"""
-    db = load_db()
-    
+    retry_after = rate_limiter.hit("login", req.email.strip().lower(), LOGIN_ACCOUNT_LIMIT)
+    if retry_after:
+        raise HTTPException(status_code=429, detail="Too many login attempts",
+                            headers={'Retry-After': retry_after_header(retry_after)})
     # Find user by email or phone
-    user = None
-    for u in db["users"]:
-        if u.get("email") == req.email or u.get("phone") == req.email:
-            user = u
-            break
+    user = store.find_by_login(req.email)
     
     if not user:
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
-    # Verify password
-    if user["password"] != hash_password(req.password):
+    # Verify password; hashes from older schemes (unsalted SHA-256) are upgraded in place
+    try:
+        matches, upgraded = await password_hasher.check(req.password, user["password"])
+    except HasherOverloaded as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={'Retry-After': '1'})
+    if not matches:
         raise HTTPException(status_code=401, detail="Invalid username or password")
+    if upgraded:
+        user["password"] = upgraded
+        await store.save(user)
     
-    # Remove password from response
-    user_response = {k: v for k, v in user.items() if k != 'password'}
+    token = authenticator.signer.issue(user["id"])
     
-    # Generate token
-    token = str(uuid.uuid4())
-    
-    return {
-        "ok": True,
-        "message": "Login successful",
-        "user": user_response,
-        "token": token
-    }
+    return user_json(user["id"], own=True, ok=True, message="Login successful", token=token)
 
 @app.get('/auth/me')
-async def get_current_user():
-    """Get current user (mock - returns demo user)"""
-    # In production, verify token and return actual user
-    db = load_db()
-    if db["users"]:
-        user = db["users"][0].copy()
-        user.pop("password", None)
-        return {"ok": True, "user": user}
-    return {"ok": False, "user": None}
+async def get_current_user(fields: Optional[str] = None, user: dict = Depends(current_user)):
+    """Get the user the bearer token belongs to (?fields=name,profilePic for a subset)"""
+    return user_json(user["id"], parse_fields(fields, user.keys()), own=True, ok=True)
 
 @app.put('/auth/profile')
-async def update_profile(req: UpdateProfileRequest):
-    """Update user profile"""
-    db = load_db()
-    
-    # For demo, update first user (in production, use token to identify user)
-    if not db["users"]:
+async def update_profile(req: UpdateProfileRequest, me: dict = Depends(current_user)):
+    """Update the current user's profile"""
+    user = store.get(me["id"])
+    if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user = db["users"][0]
-    
     # Update fields
     if req.name:
         user["name"] = req.name
@@ -208,125 +376,393 @@ async def update_profile(req: UpdateProfileRequest):
     if req.profileBackground:
         user["profileBackground"] = req.profileBackground
     
-    save_db(db)
+    authenticator.invalidate(user["id"])
+    user_views.invalidate(user["id"])
+    await asyncio.gather(
+        store.save(user),
+        changelog.record(user_scope(user["id"]), PROFILE, user["id"], project(user))
+    )
     
-    # Remove password from response
-    user_response = {k: v for k, v in user.items() if k != 'password'}
-    
-    return {
-        "ok": True,
-        "message": "Profile updated successfully",
-        "user": user_response
-    }
+    return user_json(user["id"], own=True, ok=True, message="Profile updated successfully")
+
+@app.get('/users/{user_id}')
+async def get_user(user_id: int, fields: Optional[str] = None):
+    """A user's public profile, without contact details or wallet (?fields=name,profilePic for a subset)"""
+    if store.get(user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_json(user_id, parse_fields(fields), ok=True)
+
+@app.get('/users')
+async def get_users(ids: str = '', fields: Optional[str] = None):
+    """Public profiles for a list view: ?ids=10001,10002&fields=name,profilePic"""
+    try:
+        user_ids = [int(i) for i in ids.split(',') if i]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma separated user IDs")
+    if len(user_ids) > USERS_LIST_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {USERS_LIST_MAX} ids per request")
+    return Response(envelope("users", user_views.encoded_many(user_ids, parse_fields(fields)), ok=True),
+                    media_type="application/json")
+
+# ==================== LIFECYCLE ====================
+async def hourly_maintenance():
+    """Delete expired upload sessions, stories and change-log entries past retention"""
+    while True:
+        await io_pool.run(multipart_uploads.sweep)
+        await io_pool.run(blob_store.release_expired)
+        await io_pool.run(changelog.truncate)
+        await asyncio.sleep(3600)
+
+@app.on_event('startup')
+async def start_store():
+    await store.start()
+    await changelog.start()
+    await message_store.start()
+    await bus.start(hub.publish)
+    await presence.start()
+    loop_lag.start()
+    background_tasks.append(asyncio.create_task(hourly_maintenance()))
+
+@app.on_event('shutdown')
+async def stop_store():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await loop_lag.stop()
+    await presence.stop()
+    await bus.stop()
+    await message_store.stop()
+    await changelog.stop()
+    await store.stop()
+    message_store.close()
+    changelog.close()
+    store.close()
+    blob_store.close()
+    password_hasher.shutdown()
 
 # ==================== OTHER ENDPOINTS ====================
 @app.get('/')
-async def root():
+async def root(request: Request):
     index_path = os.path.join(STATIC_DIR, 'index.html')
-    if os.path.exists(index_path):
-        return FileResponse(index_path, media_type='text/html')
-    return {"message": "Messenger API (dev) running", "users": len(load_db()["users"])}
+    response = await serve_file(request, index_path, 'text/html', REVALIDATE)
+    if response is not None:
+        return response
+    return {"message": "Messenger API (dev) running", "users": store.count()}
+
+@app.get('/metrics/io')
+async def io_metrics():
+    """I/O pool queue depth, group-commit counters and event-loop lag"""
+    return {
+        "ok": True,
+        "io_pool": io_pool.stats(),
+        "writer": store.writer.stats(),
+        "message_writer": message_store.writer.stats(),
+        "changelog_writer": changelog.writer.stats(),
+        "loop_lag": loop_lag.stats(),
+        "websockets": hub.stats(),
+        "presence": presence.stats(),
+        "auth_cache": authenticator.stats(),
+        "user_views": user_views.stats(),
+        "passwords": password_hasher.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "bus": bus.stats()
+    }
+
+def frame_room(frame):
+    """Room a client frame targets: its "room" or "conversationId", else the lobby"""
+    if isinstance(frame, dict):
+        return str(frame.get("room") or frame.get("conversationId") or DEFAULT_ROOM)
+    return DEFAULT_ROOM
+
+def batch_ack(messages):
+    """Single acknowledgement for a batch: assigned IDs in request order plus per-message details"""
+    return {
+        "ids": [m["id"] for m in messages],
+        "acks": [
+            {
+                "clientId": m.get("clientId"),
+                "messageId": m["id"],
+                "conversationId": m["conversationId"],
+                "seq": m["seq"],
+                "timestamp": m["timestamp"]
+            }
+            for m in messages
+        ]
+    }
+
+async def publish_messages(messages):
+    """Relay stored messages with one frame per conversation"""
+    by_conversation = {}
+    for message in messages:
+        by_conversation.setdefault(message["conversationId"], []).append(message)
+    for conversation_id, items in by_conversation.items():
+        frame = {"type": "messages", "conversationId": conversation_id, "messages": items}
+        await bus.publish(conversation_id, json.dumps(frame))
 
 @app.websocket('/ws')
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    connections.add(websocket)
+    """
+    Every connection must send a frame (e.g. {"type": "ping"}, answered with a pong, or a
+    pong to the server's ping) at least every MESSENGER_WS_DEAD_TIMEOUT seconds.
+    Connect with ?token=<session token> to take part in presence. {"type": "typing", "conversationId": "...",
+    "typing": true|false} and {"type": "presence", "status": "online"|"away"} are
+    coalesced into {"type": "presence", "events": [...]} frames for the user's rooms.
+    Frames are JSON text unless the client offers a binary subprotocol
+    (msgpack, cbor, or either with ".deflate"; "json.deflate" also works) in
+    Sec-WebSocket-Protocol, in which case both directions use that encoding.
+    {"type": "join"|"leave", "room": "..."} manage membership;
+    {"type": "send_batch", "batchId": "...", "messages": [...]} stores messages and
+    is answered with one {"type": "ack"} frame. Anything else is relayed to its
+    room ("room"/"conversationId"), or to the lobby every connection joins, which
+    keeps old broadcast clients working.
+    """
+    codec = negotiate(websocket.scope.get("subprotocols") or [])
+    await websocket.accept(subprotocol=codec.name if codec else None)
+    codec = codec or JSON
+    conn = hub.register(websocket, codec)
+    try:
+        me = authenticator.resolve(websocket.query_params["token"])
+    except (KeyError, InvalidToken):
+        me = None
+    presence.connect(conn, me["id"] if me else None)
     try:
-        while True:
-            data = await websocket.receive_text()
-            for conn in list(connections):
+        while not conn.closed:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            data = message.get("text")
+            if data is None:
+                data = message.get("bytes")
+            try:
+                frame = codec.decode(data)
+            except ValueError:
+                if codec.binary:
+                    continue
+                frame = None
+            if codec.binary:
+                # Relayed frames travel between workers as JSON; the hub re-encodes
+                # them once per codec in the receiving room
+                data = json.dumps(frame)
+
+            frame_type = frame.get("type") if isinstance(frame, dict) else None
+            presence.received(conn, frame_type)
+            if frame_type == "ping":
+                conn.reply({"type": "pong"})
+            elif frame_type == "pong":
+                pass
+            elif frame_type == "typing":
+                presence.typing(conn, frame_room(frame), bool(frame.get("typing", True)))
+            elif frame_type == "presence":
+                presence.set_status(conn, frame.get("status"))
+            elif frame_type == "join":
+                hub.join(conn, frame_room(frame))
+                presence.joined(conn, frame_room(frame))
+            elif frame_type == "leave":
+                hub.leave(conn, frame_room(frame))
+            elif frame_type == "send_batch":
                 try:
-                    await conn.send_text(data)
-                except Exception:
-                    try:
-                        await conn.close()
-                    except Exception:
-                        pass
+                    messages = await message_store.append_many(frame.get("messages") or [])
+                except ValueError as e:
+                    conn.reply({"type": "error", "batchId": frame.get("batchId"), "detail": str(e)})
+                    continue
+                conn.reply({"type": "ack", "batchId": frame.get("batchId"), **batch_ack(messages)})
+                await publish_messages(messages)
+            else:
+                await bus.publish(frame_room(frame), data)
     except Exception:
         pass
     finally:
-        try:
-            connections.discard(websocket)
-            await websocket.close()
-        except Exception:
-            pass
+        presence.disconnect(conn)
+        hub.unregister(conn)
 
 @app.post('/upload')
 async def upload_file(file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail='No filename')
-    ext = os.path.splitext(file.filename)[1]
-    name = f"{uuid.uuid4().hex}{ext}"
-    path = os.path.join(UPLOAD_DIR, name)
-    with open(path, 'wb') as f:
-        f.write(await file.read())
-    return {"url": f"/uploads/{name}"}
+    stored = await store_upload(file, "upload")
+    return {"url": f"/uploads/{stored.name}", "size": stored.size, "sha256": stored.sha256}
 
 @app.get('/uploads/{filename}')
-async def serve_upload(filename: str):
-    path = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(path):
+async def serve_upload(filename: str, request: Request):
+    path = blob_store.locate(filename)
+    digest = blob_store.digest_of(filename)
+    # Blobs have no extension on disk, so guess the type from the public name
+    media_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    cache_control = IMMUTABLE if digest else LEGACY_UPLOAD_CACHE
+    response = await serve_file(request, path, media_type, cache_control, digest) if path else None
+    if response is None:
         raise HTTPException(status_code=404, detail='Not found')
-    return FileResponse(path)
+    return response
 
 @app.post('/messages/send')
 async def send_message(req: dict):
+    """Store a message and relay it to the conversation's websocket room"""
+    conversation_id = req.get("conversationId")
+    if not conversation_id:
+        raise HTTPException(status_code=400, detail='conversationId is required')
+    message = await message_store.append(str(conversation_id), req)
+    await bus.publish(message["conversationId"], json.dumps({"type": "message", "message": message}))
     return {
-        "messageId": f"msg_{uuid.uuid4().hex[:8]}",
-        "timestamp": datetime.now().isoformat(),
-        "status": "sent"
+        "messageId": message["id"],
+        "seq": message["seq"],
+        "timestamp": message["timestamp"],
+        "status": message["status"],
+        "message": message
     }
 
+@app.post('/messages/batch')
+async def send_message_batch(req: BatchSendRequest):
+    """Store many messages in one round trip; each needs a conversationId"""
+    try:
+        messages = await message_store.append_many(req.messages)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await publish_messages(messages)
+    return {"ok": True, **batch_ack(messages)}
+
 @app.post('/attachments/upload')
 async def upload_attachment(file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail='No filename')
-    ext = os.path.splitext(file.filename)[1]
-    name = f"{uuid.uuid4().hex}{ext}"
-    path = os.path.join(UPLOAD_DIR, name)
-    with open(path, 'wb') as f:
-        f.write(await file.read())
+    stored = await store_upload(file, "attachment")
     return {
         "attachmentId": f"att_{uuid.uuid4().hex[:8]}",
-        "url": f"/uploads/{name}",
+        "url": f"/uploads/{stored.name}",
         "fileName": file.filename,
-        "mimeType": file.content_type
+        "mimeType": file.content_type,
+        "size": stored.size,
+        "sha256": stored.sha256
     }
 
-@app.get('/conversations/{conversation_id}')
-async def get_conversation(conversation_id: str):
+# ==================== RESUMABLE UPLOADS ====================
+@app.post('/attachments/uploads')
+async def initiate_upload(req: InitiateUploadRequest):
+    """Start a resumable multipart upload session"""
+    try:
+        session = await multipart_uploads.initiate(req.fileName, req.mimeType, req.size)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return {"ok": True, **session}
+
+@app.get('/attachments/uploads/{upload_id}')
+async def upload_status(upload_id: str):
+    """List the parts received so far (used by clients to resume)"""
+    try:
+        return {"ok": True, **await multipart_uploads.status(upload_id)}
+    except UploadSessionNotFound:
+        raise HTTPException(status_code=404, detail='Upload session not found')
+
+@app.put('/attachments/uploads/{upload_id}/parts/{part_number}')
+async def upload_part(upload_id: str, part_number: int, request: Request):
+    """Upload one part as the raw request body; parts may be sent in parallel"""
+    try:
+        part = await multipart_uploads.put_part(upload_id, part_number, RequestBody(request.stream()))
+    except UploadSessionNotFound:
+        raise HTTPException(status_code=404, detail='Upload session not found')
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"ok": True, **part}
+
+@app.post('/attachments/uploads/{upload_id}/complete')
+async def complete_upload(upload_id: str):
+    """Assemble the parts into an attachment"""
+    try:
+        session = await multipart_uploads.status(upload_id)
+        stored = await multipart_uploads.complete(upload_id)
+    except UploadSessionNotFound:
+        raise HTTPException(status_code=404, detail='Upload session not found')
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {
-        "conversationId": conversation_id,
-        "messages": [
-            {
-                "id": "msg_001",
-                "senderId": "user_123",
-                "type": "text",
-                "content": "Hello!",
-                "timestamp": datetime.now().isoformat(),
-                "status": "read"
-            }
-        ]
+        "attachmentId": f"att_{uuid.uuid4().hex[:8]}",
+        "url": f"/uploads/{stored.name}",
+        "fileName": session["fileName"],
+        "mimeType": session["mimeType"],
+        "size": stored.size,
+        "sha256": stored.sha256
     }
 
+@app.delete('/attachments/uploads/{upload_id}')
+async def abort_upload(upload_id: str):
+    """Abort a session and discard its parts"""
+    try:
+        await multipart_uploads.abort(upload_id)
+    except UploadSessionNotFound:
+        raise HTTPException(status_code=404, detail='Upload session not found')
+    return {"ok": True}
+
+@app.get('/conversations/{conversation_id}')
+async def get_conversation(conversation_id: str, before: Optional[int] = None,
+                           after: Optional[int] = None, limit: int = DEFAULT_PAGE):
+    """
+    One page of history, oldest first. No cursor returns the latest page;
+    pass the returned "before" to load older messages or "after" to load newer ones.
+    """
+    page = await message_store.history(conversation_id, before=before, after=after, limit=limit)
+    return {"conversationId": conversation_id, **page}
+
+@app.patch('/conversations/{conversation_id}/messages/{seq}')
+async def edit_message(conversation_id: str, seq: int, req: EditMessageRequest,
+                       me: dict = Depends(current_user)):
+    """Edit a message's content (only its sender may)"""
+    try:
+        message = await message_store.edit(conversation_id, seq, req.content, sender_id=me["id"])
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    if message is None:
+        raise HTTPException(status_code=404, detail='Message not found')
+    await bus.publish(conversation_id, json.dumps({"type": "edited", "message": message}))
+    return {"ok": True, "message": message}
+
+@app.post('/conversations/{conversation_id}/read')
+async def mark_conversation_read(conversation_id: str, req: ReadReceiptRequest,
+                                 me: dict = Depends(current_user)):
+    """Record a read receipt for the caller (has read up to seq)"""
+    receipt = await message_store.mark_read(conversation_id, me["id"], req.seq)
+    await bus.publish(conversation_id, json.dumps({"type": "read", **receipt}))
+    return {"ok": True, **receipt}
+
+@app.get('/presence')
+async def get_presence(users: str = ''):
+    """Current status (online/away/offline) of the given users (comma separated)"""
+    return {"ok": True, "users": presence.lookup(u for u in users.split(',') if u)}
+
+@app.get('/sync')
+async def delta_sync(cursor: int = 0, conversations: str = '', users: str = '',
+                     limit: int = DEFAULT_SYNC_LIMIT, me: dict = Depends(current_user)):
+    """
+    Changes since a cursor for the given conversations and users (comma separated).
+    Each entry is [seq, kind, entity, data] with kind m (message), r (read receipt)
+    or p (profile); pass the returned cursor next time. reset=true means the
+    cursor is older than the retention window and the client must refetch.
+    Needs a bearer token; the caller's own profile changes are always
+    included, and profile data is the public view.
+    """
+    scopes = [conversation_scope(c) for c in conversations.split(',') if c]
+    scopes += [user_scope(u) for u in {*filter(None, users.split(',')), str(me["id"])}]
+    return {"ok": True, **await changelog.since(scopes, cursor, limit)}
+
 @app.post('/stories/upload')
 async def upload_story(file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail='No filename')
-    ext = os.path.splitext(file.filename)[1]
-    name = f"story_{uuid.uuid4().hex}{ext}"
-    path = os.path.join(UPLOAD_DIR, name)
-    with open(path, 'wb') as f:
-        f.write(await file.read())
+    expires = time.time() + STORY_TTL
+    stored = await store_upload(file, "story", expires=expires)
     return {
         "storyId": f"story_{uuid.uuid4().hex[:8]}",
-        "url": f"/uploads/{name}",
-        "expiresAt": datetime.now().isoformat()
+        "url": f"/uploads/{stored.name}",
+        "expiresAt": datetime.fromtimestamp(expires).isoformat()
     }
 
 @app.get('/{full_path:path}')
-async def spa_fallback(full_path: str):
+async def spa_fallback(full_path: str, request: Request):
     index_path = os.path.join(STATIC_DIR, 'index.html')
-    if os.path.exists(index_path):
-        return FileResponse(index_path, media_type='text/html')
+    response = await serve_file(request, index_path, 'text/html', REVALIDATE)
+    if response is not None:
+        return response
     return {"message": "Messenger API (dev) running"}
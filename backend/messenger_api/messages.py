@@ -0,0 +1,283 @@
+"""
+Message Store
+Conversation-partitioned message log with (conversation_id, seq) ordering and cursor pagination
+"""
+
+import json
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from changelog import MESSAGE, RECEIPT, ChangeLog, conversation_scope
+from io_pool import io_pool
+from writer import GroupCommitter
+
+# Columns with their own field; anything else a client sends is kept in "extra"
+MESSAGE_FIELDS = ("id", "conversationId", "seq", "senderId", "type", "content", "timestamp", "status")
+
+DEFAULT_PAGE = 50
+MAX_PAGE = 200
+MAX_BATCH = 500
+
+
+class MessageStore:
+    """
+    Messages are clustered on (conversation_id, seq) in a WITHOUT ROWID table,
+    so a conversation's history is one contiguous range of the B-tree: a send
+    appends at the end of its conversation and a page read is a single range
+    scan. Writes go through a group committer, and sequence numbers are
+    assigned inside its write transaction (which holds the database write
+    lock), so processes sharing the file never hand out the same seq. When a
+    change log is attached, new/edited messages and read receipts are
+    recorded there for delta sync, in the same transaction as the messages.
+    The change log must use the same database file.
+    """
+
+    def __init__(self, path: str, commit_window: float = 0.005, changelog: Optional[ChangeLog] = None):
+        self.changelog = changelog
+        if changelog is not None and path == ":memory:":
+            # A private in-memory database can't be opened twice: share the log's
+            self._lock, self._conn = changelog.connection()
+        else:
+            self._lock = threading.Lock()
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, id TEXT NOT NULL, "
+            "sender_id TEXT, type TEXT NOT NULL, content TEXT, timestamp TEXT NOT NULL, "
+            "status TEXT NOT NULL, extra TEXT, "
+            "PRIMARY KEY (conversation_id, seq)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS read_receipts ("
+            "conversation_id TEXT NOT NULL, user_id TEXT NOT NULL, seq INTEGER NOT NULL, "
+            "updated TEXT NOT NULL, PRIMARY KEY (conversation_id, user_id)) WITHOUT ROWID"
+        )
+        self.writer = GroupCommitter(self._write_rows, window=commit_window)
+
+    # ---- blocking helpers (run on io_pool) ----
+
+    def _write_rows(self, rows: List[tuple]) -> None:
+        """
+        Rows are ("messages", new message), ("edits", message) or ("receipts", values)
+
+        New messages get their seq here, in order, and it is written back into
+        the message dict. Their change-log entries go into the same transaction.
+        """
+        messages = [message for table, message in rows if table == "messages"]
+        edits = [self._to_row(message) for table, message in rows if table == "edits"]
+        receipts = [values for table, values in rows if table == "receipts"]
+        with self._lock:
+            # IMMEDIATE takes the write lock before the MAX(seq) reads
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                next_seq: Dict[str, int] = {}
+                for message in messages:
+                    conversation_id = message["conversationId"]
+                    if conversation_id not in next_seq:
+                        row = self._conn.execute(
+                            "SELECT MAX(seq) FROM messages WHERE conversation_id = ?", (conversation_id,)
+                        ).fetchone()
+                        next_seq[conversation_id] = row[0] or 0
+                    next_seq[conversation_id] += 1
+                    message["seq"] = next_seq[conversation_id]
+                self._conn.executemany(
+                    "INSERT INTO messages (conversation_id, seq, id, sender_id, type, "
+                    "content, timestamp, status, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [self._to_row(message) for message in messages],
+                )
+                self._conn.executemany(
+                    "UPDATE messages SET content = ?, extra = ? WHERE conversation_id = ? AND seq = ?",
+                    [(row[5], row[8], row[0], row[1]) for row in edits],
+                )
+                self._conn.executemany(
+                    "INSERT INTO read_receipts (conversation_id, user_id, seq, updated) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (conversation_id, user_id) DO UPDATE SET "
+                    "seq = MAX(seq, excluded.seq), updated = excluded.updated",
+                    receipts,
+                )
+                if self.changelog is not None:
+                    self.changelog.write(self._conn, self._changes(rows))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _changes(rows: List[tuple]) -> List[tuple]:
+        """Change-log entries for written rows (messages need their seq assigned)"""
+        changes = []
+        for table, value in rows:
+            if table == "receipts":
+                conversation_id, user_id, seq = value[:3]
+                changes.append((conversation_scope(conversation_id), RECEIPT, f"{conversation_id}:{user_id}",
+                                {"userId": user_id, "seq": seq}))
+            else:
+                changes.append((conversation_scope(value["conversationId"]), MESSAGE,
+                                f"{value['conversationId']}:{value['seq']}", value))
+        return changes
+
+    def _query(self, sql: str, params: tuple) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ---- rows <-> dicts ----
+
+    @staticmethod
+    def _to_row(message: dict) -> tuple:
+        extra = {k: v for k, v in message.items() if k not in MESSAGE_FIELDS}
+        return (
+            message["conversationId"], message["seq"], message["id"], message.get("senderId"),
+            message["type"], message.get("content"), message["timestamp"], message["status"],
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+
+    @staticmethod
+    def _from_row(row: tuple) -> dict:
+        conversation_id, seq, message_id, sender_id, msg_type, content, timestamp, status, extra = row
+        message = json.loads(extra) if extra else {}
+        message.update({
+            "id": message_id,
+            "conversationId": conversation_id,
+            "seq": seq,
+            "senderId": sender_id,
+            "type": msg_type,
+            "content": content,
+            "timestamp": timestamp,
+            "status": status,
+        })
+        return message
+
+    # ---- public API ----
+
+    def _build(self, conversation_id: str, fields: dict) -> dict:
+        """Server-side fields of a new message (its seq is assigned when it is written)"""
+        message = {k: v for k, v in fields.items() if k not in MESSAGE_FIELDS}
+        message.update({
+            "id": f"msg_{uuid.uuid4().hex[:8]}",
+            "conversationId": conversation_id,
+            "seq": None,
+            "senderId": fields.get("senderId"),
+            "type": fields.get("type") or "text",
+            "content": fields.get("content"),
+            "timestamp": datetime.now().isoformat(),
+            "status": "sent",
+        })
+        return message
+
+    async def _commit(self, messages: List[dict] = (), receipts: List[tuple] = (),
+                      edits: List[dict] = ()) -> None:
+        """Write new messages, edits and receipts (with their change-log entries) in one commit"""
+        # New messages have no seq yet, so they are keyed by identity
+        items = [(id(m), ("messages", m)) for m in messages]
+        items += [((m["conversationId"], m["seq"]), ("edits", m)) for m in edits]
+        items += [((r[0], "read", r[1]), ("receipts", r)) for r in receipts]
+        await self.writer.commit_many(items)
+
+    async def append(self, conversation_id: str, fields: dict) -> dict:
+        """Store a message and return it once durable"""
+        message = self._build(conversation_id, fields)
+        await self._commit([message])
+        return message
+
+    async def append_many(self, items: List[dict]) -> List[dict]:
+        """
+        Store a batch of messages (each with a conversationId) in one commit
+
+        The batch is written in one transaction with seqs assigned in request
+        order, so it occupies a contiguous run of each conversation's sequence.
+        """
+        if len(items) > MAX_BATCH:
+            raise ValueError(f"At most {MAX_BATCH} messages per batch")
+        for fields in items:
+            if not isinstance(fields, dict) or not fields.get("conversationId"):
+                raise ValueError("Every message needs a conversationId")
+
+        messages = [self._build(str(fields["conversationId"]), fields) for fields in items]
+        await self._commit(messages)
+        return messages
+
+    async def get(self, conversation_id: str, seq: int) -> Optional[dict]:
+        rows = await io_pool.run(
+            self._query,
+            "SELECT conversation_id, seq, id, sender_id, type, content, timestamp, status, extra "
+            "FROM messages WHERE conversation_id = ? AND seq = ?",
+            (conversation_id, seq),
+        )
+        return self._from_row(rows[0]) if rows else None
+
+    async def edit(self, conversation_id: str, seq: int, content: str, sender_id=None) -> Optional[dict]:
+        """
+        Replace a message's content; returns None if it does not exist
+
+        Raises:
+            PermissionError: sender_id is given and the message was sent by someone else
+        """
+        message = await self.get(conversation_id, seq)
+        if message is None:
+            return None
+        if sender_id is not None and str(message.get("senderId")) != str(sender_id):
+            raise PermissionError("Only the sender can edit a message")
+        message["content"] = content
+        message["editedAt"] = datetime.now().isoformat()
+        await self._commit(edits=[message])
+        return message
+
+    async def mark_read(self, conversation_id: str, user_id: str, seq: int) -> dict:
+        """Record that user_id has read the conversation up to seq"""
+        receipt = (conversation_id, str(user_id), seq, datetime.now().isoformat())
+        await self._commit(receipts=[receipt])
+        return {"conversationId": conversation_id, "userId": str(user_id), "seq": seq}
+
+    async def history(self, conversation_id: str, before: Optional[int] = None,
+                      after: Optional[int] = None, limit: int = DEFAULT_PAGE) -> dict:
+        """
+        One page of a conversation in ascending seq order
+
+        Without cursors this is the latest page. "before" pages backwards from a
+        seq, "after" pages forwards; each reads at most limit + 1 rows.
+        """
+        limit = max(1, min(limit, MAX_PAGE))
+        columns = "conversation_id, seq, id, sender_id, type, content, timestamp, status, extra"
+        if after is not None:
+            rows = await io_pool.run(
+                self._query,
+                f"SELECT {columns} FROM messages WHERE conversation_id = ? AND seq > ? "
+                "ORDER BY seq ASC LIMIT ?",
+                (conversation_id, after, limit + 1),
+            )
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+        else:
+            rows = await io_pool.run(
+                self._query,
+                f"SELECT {columns} FROM messages WHERE conversation_id = ? AND seq < ? "
+                "ORDER BY seq DESC LIMIT ?",
+                (conversation_id, before if before is not None else 2 ** 62, limit + 1),
+            )
+            has_more = len(rows) > limit
+            rows = rows[:limit][::-1]
+
+        messages = [self._from_row(row) for row in rows]
+        first = messages[0]["seq"] if messages else None
+        last = messages[-1]["seq"] if messages else None
+        return {
+            "messages": messages,
+            "before": first if (after is not None or has_more) else None,
+            "after": last,
+            "hasMore": has_more,
+        }
+
+    async def start(self) -> None:
+        await self.writer.start()
+
+    async def stop(self) -> None:
+        await self.writer.stop()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,239 @@
+"""
+Multipart Uploads
+Resumable upload sessions (initiate / put part / complete / abort) for large attachments
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import List, Optional
+
+from blobs import BlobStore
+from io_pool import io_pool
+from uploads import (CHUNK_SIZE, StoredUpload, UploadTooLarge, commit_temp, discard_temp, open_temp,
+                     stream_to_temp)
+
+SESSION_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+PART_FILE_RE = re.compile(r'^part-(\d{5})$')
+MAX_PARTS = 10000
+
+
+class UploadSessionNotFound(KeyError):
+    """Raised for unknown, expired or already completed upload sessions"""
+
+
+class RequestBody:
+    """Adapts an async byte iterator (Request.stream()) to the read() interface"""
+
+    def __init__(self, stream):
+        self._it = stream.__aiter__()
+
+    async def read(self, size: int = -1) -> bytes:
+        try:
+            return await self._it.__anext__()
+        except StopAsyncIteration:
+            return b''
+
+
+class MultipartUploads:
+    """
+    Each session is a directory under <upload_dir>/.sessions/<uploadId> holding
+    session.json plus one file per part. Parts are written to temp files and
+    renamed into place, so the directory listing is always the truth about which
+    parts have arrived; that is what lets sessions survive a restart. complete()
+    claims a session by renaming its directory, so of two concurrent completes
+    only one assembles and the other finds no session.
+    """
+
+    def __init__(self, upload_dir: str, blob_store: BlobStore, ttl: float = 24 * 3600,
+                 max_bytes: int = 1024 * 1024 * 1024, part_size: int = 8 * 1024 * 1024):
+        self.root = os.path.join(upload_dir, '.sessions')
+        self.blob_store = blob_store
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.part_size = part_size
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir(self, upload_id: str) -> str:
+        if not SESSION_ID_RE.match(upload_id):
+            raise UploadSessionNotFound(upload_id)
+        return os.path.join(self.root, upload_id)
+
+    def _load(self, upload_id: str) -> dict:
+        try:
+            with open(os.path.join(self._dir(upload_id), 'session.json'), 'r', encoding='utf-8') as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            raise UploadSessionNotFound(upload_id)
+        if session["expiresAt"] < time.time():
+            shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+            raise UploadSessionNotFound(upload_id)
+        return session
+
+    def _parts(self, upload_id: str, directory: Optional[str] = None) -> List[dict]:
+        directory = directory or self._dir(upload_id)
+        parts = []
+        for entry in os.scandir(directory):
+            match = PART_FILE_RE.match(entry.name)
+            if match:
+                parts.append({"partNumber": int(match.group(1)), "size": entry.stat().st_size})
+        return sorted(parts, key=lambda p: p["partNumber"])
+
+    def _create(self, file_name: str, mime_type: Optional[str], size: Optional[int]) -> dict:
+        upload_id = uuid.uuid4().hex
+        now = time.time()
+        session = {
+            "uploadId": upload_id,
+            "fileName": file_name,
+            "mimeType": mime_type,
+            "size": size,
+            "partSize": self.part_size,
+            "createdAt": now,
+            "expiresAt": now + self.ttl,
+        }
+        directory = self._dir(upload_id)
+        os.makedirs(directory)
+        temp = os.path.join(directory, 'session.json.tmp')
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(session, f)
+        os.replace(temp, os.path.join(directory, 'session.json'))
+        return session
+
+    async def initiate(self, file_name: str, mime_type: Optional[str] = None,
+                       size: Optional[int] = None) -> dict:
+        if size is not None and size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        return await io_pool.run(self._create, file_name, mime_type, size)
+
+    async def status(self, upload_id: str) -> dict:
+        session = await io_pool.run(self._load, upload_id)
+        session["parts"] = await io_pool.run(self._parts, upload_id)
+        return session
+
+    def _other_parts_size(self, upload_id: str, part_number: int) -> int:
+        return sum(p["size"] for p in self._parts(upload_id) if p["partNumber"] != part_number)
+
+    def _commit_part(self, f, upload_id: str, part_number: int) -> None:
+        """Move a received part into place, unless that takes the session over max_bytes"""
+        directory = self._dir(upload_id)
+        path = os.path.join(directory, f"part-{part_number:05d}")
+        try:
+            # Parts arriving in parallel each passed the check in put_part; recheck now
+            if self._other_parts_size(upload_id, part_number) + os.fstat(f.fileno()).st_size > self.max_bytes:
+                discard_temp(f)
+                raise UploadTooLarge(self.max_bytes)
+            commit_temp(f, path)
+        except FileNotFoundError:
+            # Completed or aborted while this part was arriving
+            discard_temp(f)
+            raise UploadSessionNotFound(upload_id)
+
+    async def put_part(self, upload_id: str, part_number: int, source) -> dict:
+        """Store one part; re-sending a part number replaces it"""
+        if not 1 <= part_number <= MAX_PARTS:
+            raise ValueError(f"partNumber must be between 1 and {MAX_PARTS}")
+        await io_pool.run(self._load, upload_id)
+        directory = self._dir(upload_id)
+
+        try:
+            remaining = self.max_bytes - await io_pool.run(self._other_parts_size, upload_id, part_number)
+        except FileNotFoundError:
+            raise UploadSessionNotFound(upload_id)
+        if remaining <= 0:
+            raise UploadTooLarge(self.max_bytes)
+        part_limit = self.part_size * 2
+        try:
+            # Never create the directory: a complete or abort may have just removed it
+            f, size, digest = await stream_to_temp(source, directory, min(part_limit, remaining),
+                                                   create_dir=False)
+        except FileNotFoundError:
+            raise UploadSessionNotFound(upload_id)
+        except UploadTooLarge:
+            # Report the limit that was hit: the part's or the whole session's
+            raise UploadTooLarge(part_limit if part_limit < remaining else self.max_bytes)
+        await io_pool.run(self._commit_part, f, upload_id, part_number)
+        return {"partNumber": part_number, "size": size, "sha256": digest.hexdigest()}
+
+    def _claim(self, upload_id: str) -> str:
+        """Take a session out of circulation for completion; returns its new directory"""
+        claimed = os.path.join(self.root, f"{upload_id}.completing-{uuid.uuid4().hex}")
+        try:
+            os.rename(self._dir(upload_id), claimed)
+        except FileNotFoundError:
+            raise UploadSessionNotFound(upload_id)
+        return claimed
+
+    def _release(self, upload_id: str, claimed: str) -> None:
+        """Put a claimed session back (completion failed; the client may fix it and retry)"""
+        try:
+            os.rename(claimed, self._dir(upload_id))
+        except OSError:
+            shutil.rmtree(claimed, ignore_errors=True)
+
+    def _assemble(self, upload_id: str, directory: str):
+        parts = self._parts(upload_id, directory)
+        numbers = [p["partNumber"] for p in parts]
+        if not numbers:
+            raise ValueError("No parts uploaded")
+        missing = sorted(set(range(1, numbers[-1] + 1)) - set(numbers))
+        if missing:
+            raise ValueError(f"Missing parts: {missing[:20]}")
+        total = sum(p["size"] for p in parts)
+        if total > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+
+        out = open_temp(self.blob_store.temp_dir)
+        digest = hashlib.sha256()
+        try:
+            for number in numbers:
+                with open(os.path.join(directory, f"part-{number:05d}"), 'rb') as part:
+                    while True:
+                        chunk = part.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                        digest.update(chunk)
+        except BaseException:
+            discard_temp(out)
+            raise
+        return out, digest.hexdigest(), total
+
+    async def complete(self, upload_id: str) -> StoredUpload:
+        """Concatenate the parts into the blob store and close the session"""
+        session = await io_pool.run(self._load, upload_id)
+        claimed = await io_pool.run(self._claim, upload_id)
+        try:
+            out, digest, size = await io_pool.run(self._assemble, upload_id, claimed)
+        except BaseException:
+            await io_pool.run(self._release, upload_id, claimed)
+            raise
+        path = await self.blob_store.put_file(out, digest, size)
+        await io_pool.run(shutil.rmtree, claimed, True)
+        ext = os.path.splitext(session["fileName"])[1]
+        return StoredUpload(f"{digest}{ext}", path, size, digest)
+
+    async def abort(self, upload_id: str) -> None:
+        await io_pool.run(self._load, upload_id)
+        await io_pool.run(shutil.rmtree, self._dir(upload_id), True)
+
+    def sweep(self) -> int:
+        """Delete expired sessions (blocking); returns how many were removed"""
+        removed = 0
+        now = time.time()
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            try:
+                with open(os.path.join(entry.path, 'session.json'), 'r', encoding='utf-8') as f:
+                    expires_at = json.load(f)["expiresAt"]
+            except (OSError, ValueError, KeyError):
+                # Half-created session: fall back to the directory age
+                expires_at = entry.stat().st_mtime + self.ttl
+            if expires_at < now:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        return removed
@@ -0,0 +1,154 @@
+"""
+Password Hashing
+Salted KDF hashing (scrypt or PBKDF2) on a bounded process pool, with legacy SHA-256 upgrade
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from io_pool import io_pool
+
+SCRYPT = "scrypt"
+PBKDF2 = "pbkdf2_sha256"
+
+# Unsalted sha256 hex digests written before KDF hashing
+LEGACY_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class HasherOverloaded(Exception):
+    """Too many hash requests are already waiting; the caller should retry later"""
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def derive(algorithm: str, password: str, salt: bytes, params: Tuple[int, ...]) -> bytes:
+    """The KDF itself; module level so it can run in a worker process"""
+    if algorithm == SCRYPT:
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * n * r * p, dklen=32)
+    (iterations,) = params
+    return hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+
+def encode(algorithm: str, params: Tuple[int, ...], salt: bytes, key: bytes) -> str:
+    return "$".join([algorithm, *map(str, params), _b64(salt), _b64(key)])
+
+
+def decode(encoded: str) -> Optional[tuple]:
+    """(algorithm, params, salt, key) of a KDF hash, or None if it isn't one"""
+    parts = encoded.split("$")
+    try:
+        if parts[0] == SCRYPT and len(parts) == 6:
+            return SCRYPT, tuple(int(x) for x in parts[1:4]), _unb64(parts[4]), _unb64(parts[5])
+        if parts[0] == PBKDF2 and len(parts) == 4:
+            return PBKDF2, (int(parts[1]),), _unb64(parts[2]), _unb64(parts[3])
+    except ValueError:
+        pass
+    return None
+
+
+class PasswordHasher:
+    """
+    Hashes are <algorithm>$<cost params>$<salt>$<key>, so the cost can be
+    raised later and older hashes still verify (and are flagged for rehash).
+
+    The KDF is deliberately slow, so it never runs on the event loop: up to
+    max_workers hashes run at once on a process pool (or on the I/O thread
+    pool when max_workers is 0), at most max_pending more wait for a slot,
+    and anything beyond that fails fast with HasherOverloaded. Under a burst
+    of logins, latency is bounded by the queue length rather than the burst.
+    """
+
+    def __init__(self, algorithm: str = SCRYPT, scrypt_n: int = 2 ** 14, scrypt_r: int = 8,
+                 scrypt_p: int = 1, pbkdf2_iterations: int = 600_000, max_workers: int = 2,
+                 max_pending: int = 64):
+        if algorithm not in (SCRYPT, PBKDF2):
+            raise ValueError(f"Unknown password algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.params = (scrypt_n, scrypt_r, scrypt_p) if algorithm == SCRYPT else (pbkdf2_iterations,)
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.hashed = 0
+        self.rejected = 0
+        self.upgraded = 0
+
+    async def _derive(self, algorithm: str, password: str, salt: bytes, params: Tuple[int, ...]) -> bytes:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(max(1, self.max_workers))
+        if self._slots.locked() and self.waiting >= self.max_pending:
+            self.rejected += 1
+            raise HasherOverloaded("Too many password checks in progress")
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            self.hashed += 1
+            if self.max_workers <= 0:
+                return await io_pool.run(derive, algorithm, password, salt, params)
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, derive, algorithm, password, salt, params)
+        finally:
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        salt = os.urandom(16)
+        key = await self._derive(self.algorithm, password, salt, self.params)
+        return encode(self.algorithm, self.params, salt, key)
+
+    async def verify(self, password: str, encoded: str) -> Tuple[bool, bool]:
+        """(matches, needs_rehash); legacy and weaker hashes need a rehash"""
+        if LEGACY_RE.match(encoded or ""):
+            legacy = hashlib.sha256(password.encode()).hexdigest()
+            return hmac.compare_digest(legacy, encoded), True
+        parsed = decode(encoded or "")
+        if parsed is None:
+            return False, False
+        algorithm, params, salt, key = parsed
+        derived = await self._derive(algorithm, password, salt, params)
+        stale = algorithm != self.algorithm or params != self.params
+        return hmac.compare_digest(derived, key), stale
+
+    async def check(self, password: str, encoded: str) -> Tuple[bool, Optional[str]]:
+        """(matches, replacement hash); the replacement is set when a match used an outdated hash"""
+        matches, stale = await self.verify(password, encoded)
+        if not (matches and stale):
+            return matches, None
+        self.upgraded += 1
+        return True, await self.hash(password)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "algorithm": self.algorithm,
+            "params": list(self.params),
+            "workers": self.max_workers,
+            "waiting": self.waiting,
+            "max_pending": self.max_pending,
+            "hashed": self.hashed,
+            "rejected": self.rejected,
+            "upgraded": self.upgraded,
+        }
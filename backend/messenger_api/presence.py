@@ -0,0 +1,202 @@
+"""
+Presence
+Online/away state, typing indicators and heartbeat-based dead-connection detection for websockets
+"""
+
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from hub import DEFAULT_ROOM, Connection, Hub
+
+ONLINE = "online"
+AWAY = "away"
+OFFLINE = "offline"
+STATUSES = (ONLINE, AWAY)
+HEARTBEATS = ("ping", "pong")
+
+Publish = Callable[[str, str], Awaitable[None]]
+
+
+class Presence:
+    """
+    Tracks which users are connected and whether they are active.
+
+    Every hub connection must send something (any frame; {"type": "ping"} if
+    idle, or a pong to the server's ping) at least every dead_timeout seconds.
+    The server pings it after half that, and drops connections that stay
+    silent, so half-open sockets that never send a close frame are removed
+    from the hub. Presence itself only covers identified connections (opened
+    with a valid session token): a user is online while any connection had activity (a frame
+    other than ping/pong) within idle_timeout, away otherwise, offline when the
+    last connection goes.
+
+    Status and typing changes are not sent one by one: they are queued per
+    room, collapsed to the latest state per user and flushed every window
+    seconds as one {"type": "presence", "events": [...]} frame. They go only
+    to the conversation rooms the user's connections have joined, never the
+    lobby. Typing only sends transitions and expires after typing_ttl
+    seconds without a refresh.
+    """
+
+    def __init__(self, hub: Hub, publish: Publish, window: float = 0.25, idle_timeout: float = 300.0,
+                 dead_timeout: float = 60.0, typing_ttl: float = 6.0):
+        self.hub = hub
+        self.publish = publish
+        self.window = window
+        self.idle_timeout = idle_timeout
+        self.dead_timeout = dead_timeout
+        self.typing_ttl = typing_ttl
+        self._connections: Dict[str, Set[Connection]] = {}
+        self.statuses: Dict[str, str] = {}
+        # (room, userId) -> expiry for users currently shown as typing
+        self._typing: Dict[Tuple[str, str], float] = {}
+        # room -> (kind, userId) -> event, waiting for the next flush
+        self._pending: Dict[str, Dict[Tuple[str, str], dict]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.queued = 0
+        self.flushed = 0
+        self.dead_disconnects = 0
+
+    # ---- connection events ----
+
+    def connect(self, conn: Connection, user_id: Optional[str]) -> None:
+        conn.user_id = str(user_id) if user_id else None
+        conn.last_seen = conn.last_active = time.monotonic()
+        if conn.user_id:
+            self._connections.setdefault(conn.user_id, set()).add(conn)
+            self._update(conn.user_id)
+
+    def disconnect(self, conn: Connection) -> None:
+        """Forget a connection; call before hub.unregister so its rooms are still known"""
+        user_id = conn.user_id
+        conns = self._connections.get(user_id)
+        if not conns or conn not in conns:
+            return
+        rooms = self._rooms_of(user_id)
+        conns.discard(conn)
+        if conns:
+            self._update(user_id)
+            return
+        del self._connections[user_id]
+        del self.statuses[user_id]
+        for room in rooms:
+            self._stop_typing(room, user_id)
+            self._queue(room, "status", user_id, {"status": OFFLINE})
+
+    def received(self, conn: Connection, frame_type: Optional[str]) -> None:
+        """Record an inbound frame; anything but a ping/pong counts as user activity"""
+        conn.last_seen = time.monotonic()
+        if frame_type not in HEARTBEATS:
+            conn.last_active = conn.last_seen
+            if conn.status == AWAY and conn.user_id:
+                conn.status = ONLINE
+                self._update(conn.user_id)
+
+    def set_status(self, conn: Connection, status: str) -> None:
+        if status in STATUSES and conn.user_id:
+            conn.status = status
+            self._update(conn.user_id)
+
+    def joined(self, conn: Connection, room: str) -> None:
+        """Tell a room about a user who just joined it"""
+        if conn.user_id and room != DEFAULT_ROOM:
+            self._queue(room, "status", conn.user_id, {"status": self.statuses[conn.user_id]})
+
+    def typing(self, conn: Connection, room: str, is_typing: bool) -> None:
+        if not conn.user_id or room == DEFAULT_ROOM:
+            return
+        key = (room, conn.user_id)
+        if is_typing:
+            started = key not in self._typing
+            self._typing[key] = time.monotonic() + self.typing_ttl
+            if started:
+                self._queue(room, "typing", conn.user_id, {"conversationId": room, "typing": True})
+        else:
+            self._stop_typing(room, conn.user_id)
+
+    def lookup(self, user_ids: Iterable[str]) -> Dict[str, str]:
+        return {str(u): self.statuses.get(str(u), OFFLINE) for u in user_ids}
+
+    # ---- internals ----
+
+    def _rooms_of(self, user_id: str) -> Set[str]:
+        rooms = set()
+        for conn in self._connections.get(user_id, ()):
+            rooms.update(conn.rooms)
+        rooms.discard(DEFAULT_ROOM)
+        return rooms
+
+    def _update(self, user_id: str) -> None:
+        conns = self._connections.get(user_id)
+        if not conns:
+            return
+        status = ONLINE if any(c.status == ONLINE for c in conns) else AWAY
+        if self.statuses.get(user_id) != status:
+            self.statuses[user_id] = status
+            for room in self._rooms_of(user_id):
+                self._queue(room, "status", user_id, {"status": status})
+
+    def _stop_typing(self, room: str, user_id: str) -> None:
+        if self._typing.pop((room, user_id), None) is not None:
+            self._queue(room, "typing", user_id, {"conversationId": room, "typing": False})
+
+    def _queue(self, room: str, kind: str, user_id: str, fields: dict) -> None:
+        self.queued += 1
+        # A later event for the same user replaces one still waiting to be sent
+        self._pending.setdefault(room, {})[(kind, user_id)] = {"kind": kind, "userId": user_id, **fields}
+
+    async def _flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        for room, events in pending.items():
+            self.flushed += 1
+            await self.publish(room, json.dumps({"type": "presence", "events": list(events.values())}))
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        for key, expires in list(self._typing.items()):
+            if expires <= now:
+                self._stop_typing(*key)
+        for conn in list(self.hub.connections):
+            silent = now - conn.last_seen
+            if silent > self.dead_timeout:
+                self.dead_disconnects += 1
+                self.disconnect(conn)
+                self.hub.unregister(conn)
+                continue
+            if silent > self.dead_timeout / 2 and conn.pinged < conn.last_seen:
+                conn.pinged = now
+                conn.reply({"type": "ping"})
+            if conn.user_id and conn.status == ONLINE and now - conn.last_active > self.idle_timeout:
+                conn.status = AWAY
+                self._update(conn.user_id)
+
+    async def _run_flush(self) -> None:
+        while True:
+            await asyncio.sleep(self.window)
+            if self._pending:
+                await self._flush()
+
+    async def _run_sweep(self) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            self._sweep()
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._run_flush()), asyncio.create_task(self._run_sweep())]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._connections),
+            "typing": len(self._typing),
+            "queued": self.queued,
+            "flushed": self.flushed,
+            "dead_disconnects": self.dead_disconnects,
+        }
@@ -0,0 +1,187 @@
+"""
+Static File Serving
+Conditional GET (ETag / If-None-Match), byte ranges and a small stat cache for uploads and the SPA
+"""
+
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+
+from io_pool import io_pool
+from uploads import CHUNK_SIZE
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+class StatCache:
+    """LRU of os.stat results with a short TTL, so hot files skip the stat syscall"""
+
+    MISSING = object()
+
+    def __init__(self, ttl: float = 2.0, max_entries: int = 4096):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, path: str):
+        """Cached stat_result, None for a cached miss, or StatCache.MISSING if not cached"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] < time.monotonic():
+                return self.MISSING
+            self._entries.move_to_end(path)
+            return entry[1]
+
+    def stat(self, path: str) -> Optional[os.stat_result]:
+        """Stat a regular file and cache the result (blocking)"""
+        try:
+            st = os.stat(path)
+            if not stat.S_ISREG(st.st_mode):
+                st = None
+        except OSError:
+            st = None
+        with self._lock:
+            self._entries[path] = (time.monotonic() + self.ttl, st)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return st
+
+    async def get(self, path: str) -> Optional[os.stat_result]:
+        st = self.lookup(path)
+        if st is self.MISSING:
+            st = await io_pool.run(self.stat, path)
+        return st
+
+
+stat_cache = StatCache()
+
+
+def make_etag(st: os.stat_result, digest: Optional[str] = None) -> str:
+    """Strong ETag: the content digest when known, else size + mtime + inode"""
+    if digest:
+        return f'"{digest}"'
+    return f'"{st.st_size:x}-{st.st_mtime_ns:x}-{st.st_ino:x}"'
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == '*':
+        return True
+    tags = [t.strip() for t in header.split(',')]
+    return etag in tags or f"W/{etag}" in tags
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=" range into an inclusive (start, end)
+
+    Returns None for headers we ignore (multiple ranges, other units), which
+    means "send the whole file".
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if first == '':
+            length = int(last)
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if first == '':
+        # A suffix of an empty file has no bytes to satisfy it
+        if length <= 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - length), size - 1
+    if start >= size or end < start:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+def _read_at(f, offset: int, length: int) -> bytes:
+    f.seek(offset)
+    return f.read(length)
+
+
+async def _iter_range(path: str, start: int, end: int):
+    f = await io_pool.run(open, path, 'rb')
+    try:
+        offset = start
+        while offset <= end:
+            chunk = await io_pool.run(_read_at, f, offset, min(CHUNK_SIZE, end - offset + 1))
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+    finally:
+        await io_pool.run(f.close)
+
+
+def _not_modified(request: Request, etag: str, st: os.stat_result) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(st.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def serve_file(request: Request, path: str, media_type: str, cache_control: str,
+                     digest: Optional[str] = None) -> Response:
+    """
+    Serve a file with validators, conditional GET and single byte-range support
+
+    Full responses go through FileResponse, which uses the server's zero-copy
+    path (ASGI pathsend / sendfile) where available.
+
+    Returns:
+        Response, or None if the file does not exist
+    """
+    st = await stat_cache.get(path)
+    if st is None:
+        return None
+
+    etag = make_etag(st, digest)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": cache_control,
+        "Accept-Ranges": "bytes",
+    }
+    if _not_modified(request, etag, st):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, st.st_size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.st_size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{st.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(_iter_range(path, start, end), status_code=206,
+                                     media_type=media_type, headers=headers)
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=st)
@@ -0,0 +1,470 @@
+"""
+User Storage
+Keeps users in memory and persists single-record changes to a backend that
+may be shared by several worker processes
+"""
+
+import asyncio
+import copy
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from io_pool import io_pool
+from writer import GroupCommitter
+
+INDEXED_FIELDS = ("email", "phone", "idNumber")
+
+
+class DuplicateUserError(ValueError):
+    """Raised when an insert/update would reuse another user's email, phone or idNumber"""
+
+    def __init__(self, field: str):
+        super().__init__(f"{field} already registered")
+        self.field = field
+
+
+class StorageBackend:
+    """Interface for persisting user records and small metadata values"""
+
+    def load_users(self) -> List[dict]:
+        raise NotImplementedError
+
+    def put_users(self, users: List[dict]) -> Optional[Dict[int, DuplicateUserError]]:
+        """
+        Insert or replace users in one transaction
+
+        Returns:
+            {position in users: DuplicateUserError} for records rejected because
+            another user already holds their email, phone or idNumber
+        """
+        raise NotImplementedError
+
+    def find_user(self, field: str, value) -> Optional[dict]:
+        """The stored user whose field ("id" or an indexed field) equals value"""
+        raise NotImplementedError
+
+    def get_meta(self, key: str, default=None):
+        raise NotImplementedError
+
+    def set_meta(self, key: str, value) -> None:
+        raise NotImplementedError
+
+    def setdefault_meta(self, key: str, value):
+        """Store value under key unless one is already set; returns the stored value"""
+        raise NotImplementedError
+
+    def reserve_block(self, key: str, size: int, default: int) -> int:
+        """
+        Atomically advance the counter stored under key by size
+
+        Returns:
+            First value of the reserved block (the counter before the advance,
+            or default if it was never set)
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryBackend(StorageBackend):
+    """Non-persistent backend (tests and throwaway dev servers)"""
+
+    def __init__(self):
+        self._users: Dict[int, dict] = {}
+        self._meta: Dict[str, object] = {}
+        # field -> value -> user id, so find_user() (every index miss) stays O(1)
+        self._ids: Dict[str, Dict[str, int]] = {field: {} for field in INDEXED_FIELDS}
+
+    def load_users(self) -> List[dict]:
+        return [json.loads(json.dumps(u)) for u in self._users.values()]
+
+    def put_users(self, users: List[dict]) -> Optional[Dict[int, DuplicateUserError]]:
+        for user in users:
+            old = self._users.get(user["id"], {})
+            for field in INDEXED_FIELDS:
+                if old.get(field) and self._ids[field].get(old[field]) == user["id"]:
+                    del self._ids[field][old[field]]
+                if user.get(field):
+                    self._ids[field][user[field]] = user["id"]
+            self._users[user["id"]] = json.loads(json.dumps(user))
+        return None
+
+    def find_user(self, field: str, value) -> Optional[dict]:
+        user_id = value if field == "id" else self._ids[field].get(value)
+        user = self._users.get(user_id)
+        return json.loads(json.dumps(user)) if user else None
+
+    def get_meta(self, key: str, default=None):
+        return self._meta.get(key, default)
+
+    def set_meta(self, key: str, value) -> None:
+        self._meta[key] = value
+
+    def setdefault_meta(self, key: str, value):
+        return self._meta.setdefault(key, value)
+
+    def reserve_block(self, key: str, size: int, default: int) -> int:
+        start = self._meta.get(key, default)
+        self._meta[key] = start + size
+        return start
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    SQLite backend in WAL mode, one row per user
+
+    email, phone and idNumber are also kept in UNIQUE-indexed columns, so the
+    database itself refuses a duplicate written by another process. Lookups
+    use a second connection and don't wait behind a group-commit flush.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Commits are batched by the group committer, so a full sync per commit is affordable
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        self._add_unique_columns()
+        self._read_lock = threading.Lock()
+        self._reader = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+
+    def _add_unique_columns(self) -> None:
+        """Add the indexed columns to a users table created before they existed"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(users)")}
+        for field in INDEXED_FIELDS:
+            if field not in columns:
+                self._conn.execute(f'ALTER TABLE users ADD COLUMN "{field}" TEXT')
+                # Backfill; if old data holds a duplicate, the lowest id keeps the value
+                self._conn.execute(
+                    f'''UPDATE users SET "{field}" = NULLIF(json_extract(data, '$.{field}'), '')
+                        WHERE id IN (SELECT MIN(id) FROM users GROUP BY json_extract(data, '$.{field}'))'''
+                )
+            self._conn.execute(
+                f'CREATE UNIQUE INDEX IF NOT EXISTS users_{field} ON users ("{field}")'
+            )
+
+    def load_users(self) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM users ORDER BY id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def put_users(self, users: List[dict]) -> Optional[Dict[int, DuplicateUserError]]:
+        if not users:
+            return None
+        rejected = {}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for position, user in enumerate(users):
+                    keys = [user.get(field) or None for field in INDEXED_FIELDS]
+                    try:
+                        # A constraint error undoes only this statement, not the batch
+                        self._conn.execute(
+                            '''INSERT INTO users (id, data, email, phone, "idNumber") VALUES (?, ?, ?, ?, ?)
+                               ON CONFLICT (id) DO UPDATE SET data = excluded.data, email = excluded.email,
+                               phone = excluded.phone, "idNumber" = excluded."idNumber"''',
+                            (user["id"], json.dumps(user, ensure_ascii=False), *keys),
+                        )
+                    except sqlite3.IntegrityError as e:
+                        # "UNIQUE constraint failed: users.email"
+                        rejected[position] = DuplicateUserError(str(e).rpartition(".")[2])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return rejected
+
+    def find_user(self, field: str, value) -> Optional[dict]:
+        if field != "id" and field not in INDEXED_FIELDS:
+            raise ValueError(f"{field} is not indexed")
+        with self._read_lock:
+            row = self._reader.execute(
+                f'SELECT data FROM users WHERE "{field}" = ?', (value,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_meta(self, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key: str, value) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (key, json.dumps(value)),
+            )
+
+    def setdefault_meta(self, key: str, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0])
+
+    def reserve_block(self, key: str, size: int, default: int) -> int:
+        # BEGIN IMMEDIATE takes the database write lock before the read, so
+        # other processes sharing the file can't reserve the same block
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+                start = json.loads(row[0]) if row else default
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    (key, json.dumps(start + size)),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return start
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+        with self._read_lock:
+            self._reader.close()
+
+
+class IdAllocator:
+    """
+    Hands out IDs from blocks reserved against a persisted high-water mark
+
+    Each block is claimed with one read-modify-write of the mark in a single
+    backend transaction, so processes sharing a backend get disjoint blocks.
+    Within a block allocation is an in-memory step; the backend is only
+    touched when a block runs out. IDs left unused in a block when the
+    process stops are skipped, never reissued.
+    """
+
+    def __init__(self, backend: StorageBackend, start: int, block_size: int = 100, key: str = "next_id"):
+        self.backend = backend
+        self.block_size = block_size
+        self.key = key
+        self.start = start
+        # Current block is [_next, _limit); empty until the first reserve()
+        self._next = self._limit = start
+        self._lock = threading.Lock()
+        self._reserve_lock = threading.Lock()
+
+    @property
+    def high_water(self) -> int:
+        """First ID not yet reserved in the backend (by any process)"""
+        return self.backend.get_meta(self.key, self.start)
+
+    def take(self) -> Optional[int]:
+        """Claim the next ID of the current block, or None if it is used up (call reserve())"""
+        with self._lock:
+            if self._next >= self._limit:
+                return None
+            new_id = self._next
+            self._next += 1
+            return new_id
+
+    def reserve(self) -> None:
+        """Reserve a fresh block if the current one is used up (blocking)"""
+        with self._reserve_lock:
+            if self._next < self._limit:
+                return
+            start = self.backend.reserve_block(self.key, self.block_size, self.start)
+            with self._lock:
+                self._next, self._limit = start, start + self.block_size
+
+    def allocate(self) -> int:
+        new_id = self.take()
+        while new_id is None:
+            self.reserve()
+            new_id = self.take()
+        return new_id
+
+
+class UserStore:
+    """
+    In-memory user table with hash indexes on id/email/phone/idNumber
+
+    Loaded at startup; a lookup that misses the indexes falls back to the
+    backend, so users created by another worker sharing it are found (and
+    cached) too.
+    """
+
+    DEFAULT_NEXT_ID = 10001
+
+    def __init__(self, backend: StorageBackend, legacy_json: Optional[str] = None,
+                 id_block_size: int = 100, commit_window: float = 0.005):
+        self.backend = backend
+        self.writer = GroupCommitter(backend.put_users, window=commit_window)
+        self._users: Dict[int, dict] = {}
+        self._indexes: Dict[str, Dict[str, dict]] = {field: {} for field in INDEXED_FIELDS}
+        # Index keys each user is currently filed under, so updates can unfile stale ones
+        self._indexed_keys: Dict[int, Dict[str, str]] = {}
+        # Bumped on every insert/save so derived views (user_views.py) can tell a record changed
+        self._versions: Dict[int, int] = {}
+
+        if legacy_json and backend.get_meta("next_id") is None:
+            self.import_legacy(legacy_json)
+
+        for user in backend.load_users():
+            self._remember(user)
+        start = backend.get_meta("next_id", self.DEFAULT_NEXT_ID)
+        self.ids = IdAllocator(backend, start, block_size=id_block_size)
+        self._reserving = asyncio.Lock()
+
+    def import_legacy(self, path: str) -> int:
+        """
+        Import a users_db.json file ({"users": [...], "next_id": ...})
+
+        Returns:
+            Number of users imported
+        """
+        if not os.path.exists(path):
+            return 0
+        with open(path, 'r', encoding='utf-8') as f:
+            db = json.load(f)
+
+        users = db.get("users", [])
+        self.backend.put_users(users)
+        next_id = db.get("next_id", self.DEFAULT_NEXT_ID)
+        if users:
+            next_id = max(next_id, max(u["id"] for u in users) + 1)
+        self.backend.set_meta("next_id", next_id)
+        self.backend.set_meta("imported_from", os.path.basename(path))
+        return len(users)
+
+    def export(self) -> dict:
+        """Dump the store in the legacy users_db.json shape"""
+        return {"users": list(self._users.values()), "next_id": self.ids.high_water}
+
+    def count(self) -> int:
+        return len(self._users)
+
+    def users(self) -> List[dict]:
+        return list(self._users.values())
+
+    def get(self, user_id: int) -> Optional[dict]:
+        user = self._users.get(user_id)
+        if user is None:
+            user = self._load("id", user_id)
+        return user
+
+    def version(self, user_id: int) -> int:
+        return self._versions.get(user_id, 0)
+
+    def first(self) -> Optional[dict]:
+        return next(iter(self._users.values()), None)
+
+    def find_by(self, field: str, value: str) -> Optional[dict]:
+        if not value:
+            return None
+        user = self._indexes[field].get(value)
+        if user is None:
+            user = self._load(field, value)
+        return user
+
+    def find_by_login(self, identifier: str) -> Optional[dict]:
+        """Look up a user by email or phone"""
+        if not identifier:
+            return None
+        # Both in-memory indexes before the backend, so a phone login costs no storage read
+        user = self._indexes["email"].get(identifier) or self._indexes["phone"].get(identifier)
+        if user is None:
+            user = self._load("email", identifier) or self._load("phone", identifier)
+        return user
+
+    def check_unique(self, user: dict) -> None:
+        """Raise DuplicateUserError if an indexed field belongs to another user"""
+        for field in INDEXED_FIELDS:
+            owner = self.find_by(field, user.get(field))
+            if owner is not None and owner["id"] != user["id"]:
+                raise DuplicateUserError(field)
+
+    def _load(self, field: str, value) -> Optional[dict]:
+        """Read a user missing from memory (e.g. created by another worker) and cache it"""
+        user = self.backend.find_user(field, value)
+        if user is None:
+            return None
+        # Another lookup may have cached it meanwhile; keep the record already in use
+        return self._users.get(user["id"]) or self._remember(user)
+
+    def _remember(self, user: dict) -> dict:
+        self._users[user["id"]] = user
+        self._index(user)
+        return user
+
+    def _unindex(self, user: dict) -> None:
+        for field, key in self._indexed_keys.pop(user["id"], {}).items():
+            if self._indexes[field].get(key) is user:
+                del self._indexes[field][key]
+
+    def _index(self, user: dict) -> None:
+        old_keys = self._indexed_keys.get(user["id"], {})
+        new_keys = {}
+        for field in INDEXED_FIELDS:
+            old, new = old_keys.get(field), user.get(field)
+            if old and old != new and self._indexes[field].get(old) is user:
+                del self._indexes[field][old]
+            if new:
+                self._indexes[field][new] = user
+                new_keys[field] = new
+        self._indexed_keys[user["id"]] = new_keys
+
+    async def allocate_id(self) -> int:
+        """Hand out the next user ID (no I/O unless a new block is reserved)"""
+        new_id = self.ids.take()
+        while new_id is None:
+            # One coroutine reserves the next block while the rest wait for it,
+            # rather than each queueing its own reservation on the I/O pool
+            async with self._reserving:
+                new_id = self.ids.take()
+                if new_id is None:
+                    await io_pool.run(self.ids.reserve)
+                    new_id = self.ids.take()
+        return new_id
+
+    async def insert(self, user: dict) -> dict:
+        """
+        Add a user and wait until the record is durable
+
+        Raises:
+            DuplicateUserError: An indexed field belongs to another user, here
+                or (caught by the backend's UNIQUE columns) in another worker
+        """
+        self.check_unique(user)
+        self._remember(user)
+        self._versions[user["id"]] = self.version(user["id"]) + 1
+        try:
+            await self.writer.commit(user["id"], copy.deepcopy(user))
+        except DuplicateUserError:
+            self._unindex(user)
+            del self._users[user["id"]]
+            raise
+        return user
+
+    async def save(self, user: dict) -> dict:
+        """Persist a user record after it has been modified in place"""
+        self.check_unique(user)
+        self._index(user)
+        self._versions[user["id"]] = self.version(user["id"]) + 1
+        await self.writer.commit(user["id"], copy.deepcopy(user))
+        return user
+
+    async def start(self) -> None:
+        await self.writer.start()
+
+    async def stop(self) -> None:
+        await self.writer.stop()
+
+    def close(self) -> None:
+        self.backend.close()
@@ -0,0 +1,156 @@
+"""
+Upload Pipeline
+Streams uploaded files to disk in fixed-size chunks, hashing as it goes
+"""
+
+import hashlib
+import json
+import os
+import uuid
+from typing import BinaryIO, Dict, NamedTuple, Tuple
+
+from io_pool import io_pool
+
+CHUNK_SIZE = 1024 * 1024  # 1 MiB
+
+# Multipart form framing (boundaries, part headers) allowed on top of the file limit
+FORM_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds its route's size limit"""
+
+    def __init__(self, limit: int):
+        super().__init__(f"File exceeds the {limit // (1024 * 1024)} MB limit")
+        self.limit = limit
+
+
+class StoredUpload(NamedTuple):
+    name: str
+    path: str
+    size: int
+    sha256: str
+
+
+def open_temp(directory: str, create_dir: bool = True) -> BinaryIO:
+    """
+    A new, uniquely named temp file in directory. With create_dir=False a
+    missing directory raises FileNotFoundError instead of being created.
+    """
+    if create_dir:
+        os.makedirs(directory, exist_ok=True)
+    return open(os.path.join(directory, f"{uuid.uuid4().hex}.part"), 'wb')
+
+
+def _write_chunk(f: BinaryIO, digest, chunk: bytes) -> None:
+    f.write(chunk)
+    digest.update(chunk)
+
+
+def discard_temp(f: BinaryIO) -> None:
+    f.close()
+    try:
+        os.remove(f.name)
+    except OSError:
+        pass
+
+
+def commit_temp(f: BinaryIO, path: str) -> None:
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(f.name, path)
+
+
+async def stream_to_temp(source, temp_dir: str, max_bytes: int, create_dir: bool = True):
+    """
+    Copy an async-readable source (UploadFile or similar) to a temp file
+
+    Peak memory is one chunk regardless of file size.
+
+    Args:
+        create_dir: Create temp_dir if it is missing (else FileNotFoundError)
+
+    Returns:
+        (open temp file, size, sha256 hash object); the caller commits or discards it
+    """
+    f = await io_pool.run(open_temp, temp_dir, create_dir)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            await io_pool.run(_write_chunk, f, digest, chunk)
+    except BaseException:
+        await io_pool.run(discard_temp, f)
+        raise
+    return f, size, digest
+
+
+class ASGIBodyLimit:
+    """
+    ASGI middleware: 413 for request bodies over their route's limit, before
+    the app reads them. Form endpoints otherwise get the whole body spooled
+    to disk by the framework before the handler's own size check runs.
+    A Content-Length over the limit is rejected at once; a body without one
+    is counted as it streams in and cut off when it passes the limit.
+    """
+
+    def __init__(self, app, limits: Dict[Tuple[str, str], int]):
+        """
+        Args:
+            app: The wrapped ASGI app
+            limits: (method, path) -> largest file accepted (FORM_OVERHEAD is added)
+        """
+        self.app = app
+        self.limits = limits
+
+    async def _reject(self, send, limit: int) -> None:
+        body = json.dumps({"detail": str(UploadTooLarge(limit))}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+        max_body = limit + FORM_OVERHEAD
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > max_body:
+                return await self._reject(send, limit)
+
+        received = 0
+        rejected = False
+
+        async def counted_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request" and not rejected:
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    rejected = True
+                    await self._reject(send, limit)
+                    # Looks like a client disconnect to the app, which stops reading
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, counted_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
@@ -0,0 +1,108 @@
+"""
+User Views
+Cached, pre-encoded public profile JSON with optional field selection
+"""
+
+import json
+from typing import Collection, Iterable, List, Optional, Tuple
+
+from auth import LRUCache
+from storage import UserStore
+
+# Never part of a view, whatever fields are asked for
+PRIVATE_FIELDS = frozenset({"password"})
+
+# The only fields other users see; contact details, idNumber, dob and wallet
+# are in the owner's own view only
+PUBLIC_FIELDS = ("id", "name", "gender", "bio", "profilePic", "profileBackground", "stats", "createdAt")
+
+
+def parse_fields(fields: Optional[str], known: Collection[str] = PUBLIC_FIELDS) -> Optional[Tuple[str, ...]]:
+    """
+    "name,profilePic" -> ("id", "name", "profilePic"); None/empty means every
+    visible field. Names not in known (PUBLIC_FIELDS, or the record's keys for
+    the owner's view) are dropped, so selections, and the cache keys built
+    from them, come from a small fixed set.
+    """
+    if not fields:
+        return None
+    selected = {f.strip() for f in fields.split(",")} & set(known) - PRIVATE_FIELDS
+    selected.add("id")
+    return tuple(sorted(selected))
+
+
+def project(user: dict, fields: Optional[Tuple[str, ...]] = None, own: bool = False) -> dict:
+    """
+    The part of a user record a client may see: every field but the password
+    for the user themself (own=True), PUBLIC_FIELDS for anyone else, narrowed
+    to fields if given
+    """
+    if own:
+        visible = [k for k in user if k not in PRIVATE_FIELDS]
+    else:
+        visible = [k for k in PUBLIC_FIELDS if k in user]
+    if fields is not None:
+        visible = [k for k in visible if k in fields]
+    return {k: user[k] for k in visible}
+
+
+class UserViews:
+    """
+    Profiles are projected and JSON-encoded once per (user id, record
+    version, field selection, own/public) and kept as bytes in an LRU cache,
+    so serving a profile is a cache lookup and a byte splice. The store bumps a user's
+    version on every save, so stale views are never served; invalidate()
+    additionally frees the old entries right away.
+    """
+
+    def __init__(self, store: UserStore, max_entries: int = 10000):
+        self.store = store
+        self.cache = LRUCache(max_entries, on_evict=self._forget)
+        # user id -> cache keys currently held for that user
+        self._keys = {}
+
+    def encoded(self, user_id, fields: Optional[Tuple[str, ...]] = None,
+                own: bool = False) -> Optional[bytes]:
+        """The user's profile (see project()) as JSON bytes, or None if there is no such user"""
+        key = (user_id, self.store.version(user_id), fields, own)
+        view = self.cache.get(key)
+        if view is not None:
+            return view
+        user = self.store.get(user_id)
+        if user is None:
+            return None
+        view = json.dumps(project(user, fields, own), ensure_ascii=False).encode()
+        self.cache.put(key, view)
+        keys = self._keys.setdefault(user_id, set())
+        for stale in [k for k in keys if k[1] != key[1]]:
+            keys.discard(stale)
+            self.cache.pop(stale)
+        keys.add(key)
+        return view
+
+    def encoded_many(self, user_ids: Iterable, fields: Optional[Tuple[str, ...]] = None) -> bytes:
+        """JSON array of the given users' public views (unknown ids are skipped)"""
+        views: List[bytes] = [v for v in (self.encoded(u, fields) for u in user_ids) if v is not None]
+        return b"[" + b",".join(views) + b"]"
+
+    def _forget(self, key) -> None:
+        """Drop an entry the LRU evicted from the per-user key index"""
+        keys = self._keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys[key[0]]
+
+    def invalidate(self, user_id) -> None:
+        for key in self._keys.pop(user_id, ()):
+            self.cache.pop(key)
+
+    def stats(self) -> dict:
+        return {"entries": len(self.cache), "hits": self.cache.hits, "misses": self.cache.misses}
+
+
+def envelope(key: str, encoded: bytes, **fields) -> bytes:
+    """{**fields, key: <encoded JSON>} without decoding the pre-encoded part"""
+    head = json.dumps(fields, ensure_ascii=False)[:-1].encode()
+    separator = b", " if fields else b""
+    return head + separator + json.dumps(key).encode() + b": " + encoded + b"}"
@@ -0,0 +1,136 @@
+"""
+Wire Protocol
+Websocket frame codecs (JSON, MessagePack, CBOR, each optionally deflated) negotiated by subprotocol
+"""
+
+import json
+import zlib
+from typing import Callable, Dict, List, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # pip install msgpack to offer the "msgpack" subprotocols
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pip install cbor2 to offer the "cbor" subprotocols
+    cbor2 = None
+
+Frame = Union[str, bytes]
+
+DEFLATE_SUFFIX = ".deflate"
+DEFLATE_LEVEL = 6
+# Upper bound on a decompressed client frame, so a tiny deflated frame can't expand without limit
+MAX_INFLATED = 16 * 1024 * 1024
+
+_UNSET = object()
+
+
+class Codec:
+    """
+    Encodes frame objects for one subprotocol. JSON without deflate is sent as
+    text frames (what existing clients expect); everything else is binary.
+    Deflated codecs compress each message on its own (raw deflate, no header)
+    so any frame can be decoded without the ones before it.
+    """
+
+    def __init__(self, name: str, dumps: Callable[[object], Frame], loads: Callable[[bytes], object],
+                 deflate: bool = False):
+        self.name = name
+        self.deflate = deflate
+        self.binary = deflate or name != "json"
+        self._dumps = dumps
+        self._loads = loads
+
+    def encode(self, obj) -> Frame:
+        data = self._dumps(obj)
+        if not self.deflate:
+            return data
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def decode(self, data: Frame):
+        """Frame payload -> object; raises ValueError if it can't be decoded"""
+        try:
+            if self.deflate:
+                if isinstance(data, str):
+                    data = data.encode("utf-8")
+                inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+                data = inflater.decompress(data, MAX_INFLATED)
+                if inflater.unconsumed_tail:
+                    raise ValueError("Frame is too large")
+            return self._loads(data)
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Invalid {self.name} frame: {e}") from e
+
+
+def _build_codecs() -> Dict[str, Codec]:
+    formats = {"json": (json.dumps, json.loads)}
+    if msgpack is not None:
+        formats["msgpack"] = (
+            lambda obj: msgpack.packb(obj, use_bin_type=True),
+            lambda data: msgpack.unpackb(data, raw=False),
+        )
+    if cbor2 is not None:
+        formats["cbor"] = (cbor2.dumps, cbor2.loads)
+
+    codecs = {}
+    for name, (dumps, loads) in formats.items():
+        codecs[name] = Codec(name, dumps, loads)
+        codecs[name + DEFLATE_SUFFIX] = Codec(name + DEFLATE_SUFFIX, dumps, loads, deflate=True)
+    return codecs
+
+
+CODECS = _build_codecs()
+JSON = CODECS["json"]
+
+
+def negotiate(offered: List[str]) -> Optional[Codec]:
+    """
+    First subprotocol in the client's preference order that this server
+    supports, or None (plain JSON, no subprotocol in the handshake reply)
+    """
+    for name in offered:
+        codec = CODECS.get(name.strip().lower())
+        if codec is not None:
+            return codec
+    return None
+
+
+class Broadcast:
+    """
+    One published frame, encoded at most once per codec however many
+    connections receive it
+
+    Frames travel between workers as JSON text; they are parsed only if a
+    recipient uses another codec. Binary frames and text that isn't JSON are
+    passed through (binary) or encoded as a plain string (text).
+    """
+
+    def __init__(self, frame: Frame):
+        self.frame = frame
+        self.encodes = 0
+        self._obj = _UNSET
+        self._encoded: Dict[str, Frame] = {"json": frame}
+
+    def obj(self):
+        if self._obj is _UNSET:
+            try:
+                self._obj = json.loads(self.frame)
+            except ValueError:
+                self._obj = self.frame
+        return self._obj
+
+    def encoded(self, codec: Codec) -> Frame:
+        if isinstance(self.frame, bytes):
+            return self.frame
+        data = self._encoded.get(codec.name)
+        if data is None:
+            data = self._encoded[codec.name] = codec.encode(self.obj())
+            self.encodes += 1
+        return data
@@ -0,0 +1,136 @@
+"""
+Group Commit Writer
+Coalesces records written within a short window into a single backend flush
+"""
+
+import asyncio
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from io_pool import io_pool
+
+
+class GroupCommitter:
+    """
+    Background task that batches dirty records and flushes them together
+
+    Callers await commit(); it returns once the flush containing their record
+    has finished, so a completed await is a durability acknowledgement.
+    Several writes to the same key inside one window are coalesced into the
+    latest value.
+
+    flush may return {position: exception} for records of the batch it
+    rejected (positions index the list it was given); only the callers that
+    committed those records see the exception, the rest of the batch succeeds.
+    """
+
+    def __init__(self, flush: Callable[[List[object]], Optional[Dict[int, Exception]]],
+                 window: float = 0.005):
+        self.flush = flush
+        self.window = window
+        self._pending: Dict[Hashable, object] = {}
+        # (keys committed, future) per waiting caller
+        self._waiters: List[Tuple[Tuple[Hashable, ...], asyncio.Future]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.flushes = 0
+        self.records = 0
+        self.writes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush whatever is pending and stop the background task"""
+        if not self.running:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def commit(self, key: Hashable, value: object) -> None:
+        self.writes += 1
+        if not self.running:
+            # No writer task (scripts, shutdown): flush this record on its own
+            rejected = await io_pool.run(self.flush, [value])
+            self.flushes += 1
+            self.records += 1
+            if rejected:
+                raise rejected[0]
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending[key] = value
+        self._waiters.append(((key,), waiter))
+        self._wakeup.set()
+        await waiter
+
+    async def commit_many(self, items: List[Tuple[Hashable, object]]) -> None:
+        """Commit several records together; returns once all of them are durable"""
+        if not items:
+            return
+        self.writes += len(items)
+        if not self.running:
+            rejected = await io_pool.run(self.flush, [value for _, value in items])
+            self.flushes += 1
+            self.records += len(items)
+            if rejected:
+                raise next(iter(rejected.values()))
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        for key, value in items:
+            self._pending[key] = value
+        self._waiters.append((tuple(key for key, _ in items), waiter))
+        self._wakeup.set()
+        await waiter
+
+    def stats(self) -> dict:
+        return {
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "records": self.records,
+            "pending": len(self._pending),
+            "window_ms": self.window * 1000,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            if not self._stopping:
+                await asyncio.sleep(self.window)
+            self._wakeup.clear()
+
+            batch, waiters = self._pending, self._waiters
+            self._pending, self._waiters = {}, []
+            if batch:
+                try:
+                    rejected = await io_pool.run(self.flush, list(batch.values()))
+                except Exception as e:
+                    for _, waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+                else:
+                    errors = {key: rejected[i] for i, key in enumerate(batch) if i in rejected} if rejected else {}
+                    for keys, waiter in waiters:
+                        if waiter.done():
+                            continue
+                        error = next((errors[k] for k in keys if k in errors), None)
+                        if error is None:
+                            waiter.set_result(None)
+                        else:
+                            waiter.set_exception(error)
+                self.flushes += 1
+                self.records += len(batch)
+
+            if self._stopping and not self._pending:
+                return
@@ -0,0 +1,216 @@
+"""
+Rate Limiting
+Token-bucket limits per client IP or account, shared by the Flask app and messenger_api
+
+Rules are written one per line (or separated by ';') as
+    <METHOD> <path> <count>/<period> [ip|account]
+e.g. "POST /auth/login 10/min ip; PUT /attachments/uploads/* 600/min".
+A path ending in * matches by prefix. Periods are s, min, hour or day,
+optionally with a multiplier ("5/15min"). A client may make <count>
+requests in a burst, refilling at <count> per <period>.
+"""
+
+import json
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+UNITS = {"s": 1, "sec": 1, "second": 1, "m": 60, "min": 60, "minute": 60,
+         "h": 3600, "hour": 3600, "d": 86400, "day": 86400}
+
+IP = "ip"
+ACCOUNT = "account"
+
+
+class Limit(NamedTuple):
+    count: int
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.count / self.period
+
+
+class Rule(NamedTuple):
+    method: str
+    path: str
+    limit: Limit
+    by: str = IP
+
+
+def parse_limit(text: str) -> Limit:
+    """"10/min" -> Limit(10, 60.0); "5/15min" -> Limit(5, 900.0)"""
+    count, _, period = text.strip().partition("/")
+    digits = period.rstrip("abcdefghijklmnopqrstuvwxyz")
+    unit = period[len(digits):] or "s"
+    if unit not in UNITS or int(count) <= 0:
+        raise ValueError(f"Bad rate limit: {text!r}")
+    return Limit(int(count), float(digits or 1) * UNITS[unit])
+
+
+def parse_rules(spec: str) -> List[Rule]:
+    rules = []
+    for line in spec.replace(";", "\n").splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) not in (3, 4) or (len(parts) == 4 and parts[3] not in (IP, ACCOUNT)):
+            raise ValueError(f"Bad rate limit rule: {line.strip()!r}")
+        rules.append(Rule(parts[0].upper(), parts[1], parse_limit(parts[2]), *parts[3:]))
+    return rules
+
+
+class TokenBuckets:
+    """
+    key -> [tokens, last update, time the bucket is full again]. Buckets are
+    refilled lazily when touched, so each check is O(1); a full bucket is the
+    same as no bucket, so sweep() drops those to bound memory.
+    """
+
+    def __init__(self, sweep_interval: float = 60.0, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.sweep_interval = sweep_interval
+        self._buckets: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        self._next_sweep = clock() + sweep_interval
+        self.allowed = 0
+        self.limited = 0
+
+    def take(self, key: tuple, limit: Limit) -> float:
+        """Spend one token; returns 0 if allowed, else seconds until a token is available"""
+        now = self.clock()
+        rate = limit.rate
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = limit.count
+            else:
+                tokens = min(limit.count, bucket[0] + (now - bucket[1]) * rate)
+            if tokens < 1:
+                self.limited += 1
+                return (1 - tokens) / rate
+            tokens -= 1
+            self._buckets[key] = [tokens, now, now + (limit.count - tokens) / rate]
+            self.allowed += 1
+            return 0.0
+
+    def _sweep(self, now: float) -> None:
+        for key in [k for k, b in self._buckets.items() if b[2] <= now]:
+            del self._buckets[key]
+        self._next_sweep = now + self.sweep_interval
+
+    def sweep(self) -> None:
+        with self._lock:
+            self._sweep(self.clock())
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RateLimiter:
+    """
+    Matches requests to rules and charges the matching buckets. Account
+    rules key on identify(authorization header) and fall back to the client
+    IP for anonymous requests. hit() charges an explicit key, for limits the
+    middleware can't see (e.g. attempts per login name).
+
+    trust_proxy is the number of reverse proxies in front of the app. Each
+    appends the address it received from to X-Forwarded-For, so the client is
+    the entry that many places from the right; anything left of it was sent
+    by the client and is ignored. 0 uses the socket peer.
+    """
+
+    def __init__(self, rules: Iterable[Rule], identify: Optional[Callable[[str], Optional[str]]] = None,
+                 trust_proxy: int = 0, buckets: Optional[TokenBuckets] = None):
+        self.identify = identify
+        self.trust_proxy = int(trust_proxy)
+        self.buckets = buckets or TokenBuckets()
+        self._exact: Dict[Tuple[str, str], List[Tuple[int, Rule]]] = {}
+        self._prefix: List[Tuple[int, Rule]] = []
+        for index, rule in enumerate(rules):
+            if rule.path.endswith("*"):
+                self._prefix.append((index, rule))
+            else:
+                self._exact.setdefault((rule.method, rule.path), []).append((index, rule))
+
+    def rules_for(self, method: str, path: str) -> List[Tuple[int, Rule]]:
+        matched = self._exact.get((method, path), [])
+        if self._prefix:
+            prefixed = [(i, r) for i, r in self._prefix if r.method == method and path.startswith(r.path[:-1])]
+            if prefixed:
+                matched = matched + prefixed
+        return matched
+
+    def check(self, method: str, path: str, client_ip: str, authorization: Optional[str] = None,
+              rules: Optional[List[Tuple[int, Rule]]] = None) -> float:
+        """
+        0 if the request may proceed, else seconds the client should wait.
+        rules is rules_for(method, path) when the caller has already matched them.
+        """
+        retry_after = 0.0
+        for index, rule in self.rules_for(method, path) if rules is None else rules:
+            key = client_ip
+            if rule.by == ACCOUNT and authorization and self.identify is not None:
+                key = self.identify(authorization) or client_ip
+            retry_after = max(retry_after, self.buckets.take((index, key), rule.limit))
+        return retry_after
+
+    def hit(self, name: str, key: str, limit: Limit) -> float:
+        return self.buckets.take((name, key), limit)
+
+    def client_ip(self, peer: Optional[str], forwarded_for: Optional[str]) -> str:
+        if self.trust_proxy and forwarded_for:
+            hops = [hop.strip() for hop in forwarded_for.split(",")]
+            # Fewer entries than proxies: every entry was written by one of ours
+            return hops[-min(self.trust_proxy, len(hops))] or peer or "-"
+        return peer or "-"
+
+    def stats(self) -> dict:
+        return {"buckets": len(self.buckets), "allowed": self.buckets.allowed, "limited": self.buckets.limited}
+
+
+def retry_after_header(retry_after: float) -> str:
+    """Seconds to wait, rounded up, for a Retry-After header"""
+    return str(max(1, int(retry_after + 0.999)))
+
+
+class ASGIRateLimit:
+    """ASGI middleware (FastAPI/Starlette): 429 with Retry-After when a rule is exceeded"""
+
+    def __init__(self, app, limiter: RateLimiter, body: Optional[dict] = None):
+        self.app = app
+        self.limiter = limiter
+        self.body = json.dumps(body or {"detail": "Too many requests"}).encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rules = self.limiter.rules_for(scope["method"], scope["path"])
+        if not rules:
+            return await self.app(scope, receive, send)
+        authorization = forwarded_for = None
+        if self.limiter.identify is not None or self.limiter.trust_proxy:
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    authorization = value.decode("latin-1")
+                elif name == b"x-forwarded-for":
+                    # Repeated headers form one list, in order
+                    value = value.decode("latin-1")
+                    forwarded_for = value if forwarded_for is None else f"{forwarded_for}, {value}"
+        client = scope.get("client")
+        ip = self.limiter.client_ip(client[0] if client else None, forwarded_for)
+        retry_after = self.limiter.check(scope["method"], scope["path"], ip, authorization, rules)
+        if not retry_after:
+            return await self.app(scope, receive, send)
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(self.body)).encode()),
+                (b"retry-after", retry_after_header(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": self.body})
@@ -0,0 +1,119 @@
+"""
+Message Bus Throughput Harness
+Runs 1, 2, 4... worker processes on one box, connects them through a
+SocketBus (the MESSENGER_BUS=socket relay), has every worker publish frames
+and measures how fast all of them arrive on every worker, as the worker
+count grows. The in-process InMemoryBus is timed first as a baseline.
+
+Run: python scripts/busThroughput.py [--workers 1,2,4,8] [--frames 20000] [--size 200]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "messenger_api"))
+
+from bus import InMemoryBus, SocketBus  # noqa: E402
+
+
+def worker(index: int, workers: int, frames: int, size: int, address: str, barrier, results) -> None:
+    """One uvicorn-worker stand-in: publish frames, count every frame delivered from all workers"""
+    async def main():
+        expected = workers * frames
+        received = 0
+        done = asyncio.Event()
+
+        def deliver(room, frame):
+            nonlocal received
+            received += 1
+            if received == expected:
+                done.set()
+
+        bus = SocketBus(address)
+        await bus.start(deliver)
+        loop = asyncio.get_running_loop()
+        # Everyone connected (the first to start is the broker) before the clock starts
+        await loop.run_in_executor(None, barrier.wait)
+        start = time.time()
+        payload = "x" * size
+        for n in range(frames):
+            await bus.publish(f"room{n % 16}", payload)
+        try:
+            await asyncio.wait_for(done.wait(), timeout=60 + expected / 10000)
+        except asyncio.TimeoutError:
+            pass
+        end = time.time()
+        # Keep the broker up until every worker has its frames
+        await loop.run_in_executor(None, barrier.wait)
+        await bus.stop()
+        results.put((index, start, end, received, bus.is_broker))
+
+    asyncio.run(main())
+
+
+def run_socket(workers: int, frames: int, size: int) -> dict:
+    address = f"unix:{os.path.join(tempfile.mkdtemp(prefix='bus-bench-'), 'bus.sock')}"
+    # spawn gives each worker a fresh interpreter, as uvicorn does
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(i, workers, frames, size, address, barrier, results))
+        for i in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    reports = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+    elapsed = max(r[2] for r in reports) - min(r[1] for r in reports)
+    return {
+        "elapsed": elapsed,
+        "complete": all(r[3] == workers * frames for r in reports),
+        "brokers": sum(r[4] for r in reports),
+        "published": workers * frames,
+        "delivered": sum(r[3] for r in reports),
+    }
+
+
+def run_memory(frames: int, size: int) -> float:
+    """Frames per second through InMemoryBus (publish delivers straight to the local hub)"""
+    async def main():
+        bus = InMemoryBus()
+        await bus.start(lambda room, frame: None)
+        payload = "x" * size
+        start = time.perf_counter()
+        for n in range(frames):
+            await bus.publish(f"room{n % 16}", payload)
+        return frames / (time.perf_counter() - start)
+
+    return asyncio.run(main())
+
+
+def run(worker_counts: list, frames: int, size: int) -> bool:
+    print(f"InMemoryBus (1 process): {run_memory(frames, size):,.0f} frames/sec")
+    print(f"{'workers':>7} {'published/s':>12} {'delivered/s':>12} {'seconds':>8}")
+    checks = {}
+    for workers in worker_counts:
+        result = run_socket(workers, frames, size)
+        print(f"{workers:>7} {result['published'] / result['elapsed']:>12,.0f} "
+              f"{result['delivered'] / result['elapsed']:>12,.0f} {result['elapsed']:>8.2f}")
+        checks[f"{workers} workers: every frame reached every worker"] = result["complete"]
+        checks[f"{workers} workers: one broker"] = result["brokers"] == 1
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4,8", help="comma separated worker counts")
+    parser.add_argument("--frames", type=int, default=20000, help="frames published per worker")
+    parser.add_argument("--size", type=int, default=200, help="frame payload bytes")
+    args = parser.parse_args()
+    sys.exit(0 if run([int(w) for w in args.workers.split(",")], args.frames, args.size) else 1)
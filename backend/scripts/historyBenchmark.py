@@ -0,0 +1,96 @@
+"""
+Conversation History Benchmark
+Fills one conversation with millions of messages (plus a small one beside
+it) through MessageStore's write path, then times history page reads:
+the latest page, pages deep in the past ("before" cursor) and forward pages
+("after" cursor). Each read is one range scan on (conversation_id, seq), so
+its cost should not depend on how long the conversation is.
+
+Run: python scripts/historyBenchmark.py [--messages 2000000] [--reads 2000] [--limit 50]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "messenger_api"))
+
+from messages import MessageStore  # noqa: E402
+
+FILL_BATCH = 50000
+
+
+def fill(store: MessageStore, conversation_id: str, count: int) -> float:
+    """Write count messages in FILL_BATCH-sized transactions; returns messages/sec"""
+    start = time.perf_counter()
+    for offset in range(0, count, FILL_BATCH):
+        batch = [
+            store._build(conversation_id, {"senderId": str(n % 7), "content": f"message {n} " + "x" * 60})
+            for n in range(offset, min(count, offset + FILL_BATCH))
+        ]
+        store._write_rows([("messages", message) for message in batch])
+    return count / (time.perf_counter() - start)
+
+
+async def time_reads(store: MessageStore, conversation_id: str, size: int, reads: int, limit: int) -> dict:
+    """p50/p99 milliseconds per history() call for each kind of page"""
+    rnd = random.Random(1)
+    kinds = {
+        "latest": lambda: {},
+        "before": lambda: {"before": rnd.randrange(limit + 1, size + 1)},
+        "after": lambda: {"after": rnd.randrange(0, size - limit)},
+    }
+    results = {}
+    for kind, cursor in kinds.items():
+        samples = []
+        for _ in range(reads):
+            args = cursor()
+            start = time.perf_counter()
+            page = await store.history(conversation_id, limit=limit, **args)
+            samples.append(time.perf_counter() - start)
+            assert len(page["messages"]) == limit
+        samples.sort()
+        results[kind] = (samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000)
+    return results
+
+
+def run(messages: int, reads: int, limit: int) -> bool:
+    db_path = os.path.join(tempfile.mkdtemp(prefix="history-bench-"), "messenger.db")
+    store = MessageStore(db_path)
+    small = 1000
+    print(f"filling: {fill(store, 'big', messages):,.0f} messages/sec into 'big', ", end="")
+    fill(store, "small", small)
+    print(f"database {os.path.getsize(db_path) / 2 ** 20:,.0f} MiB")
+
+    async def measure():
+        return (await time_reads(store, "small", small, reads, limit),
+                await time_reads(store, "big", messages, reads, limit))
+
+    small_times, big_times = asyncio.run(measure())
+    print(f"{'page':>7} {small:>8,} msgs p50/p99 ms {messages:>10,} msgs p50/p99 ms")
+    for kind in small_times:
+        print(f"{kind:>7} {small_times[kind][0]:>14.3f} / {small_times[kind][1]:.3f}"
+              f" {big_times[kind][0]:>19.3f} / {big_times[kind][1]:.3f}")
+    store.close()
+
+    # Flat: a page of the huge conversation within 3x (+0.2 ms of noise) of the small one's
+    checks = {
+        f"{kind} page independent of conversation length": big_times[kind][0] <= 3 * small_times[kind][0] + 0.2
+        for kind in small_times
+    }
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2_000_000, help="messages in the big conversation")
+    parser.add_argument("--reads", type=int, default=2000, help="timed reads per page kind")
+    parser.add_argument("--limit", type=int, default=50, help="messages per page")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.messages, args.reads, args.limit) else 1)
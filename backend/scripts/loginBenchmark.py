@@ -0,0 +1,79 @@
+"""
+Login Lookup Benchmark
+Times UserStore.find_by_login (the lookup behind /auth/login and the signup
+duplicate check) at growing user counts, for known logins (index hits) and
+unknown ones (index miss, then indexed SQLite reads). Latency should stay
+flat as the user base grows; a linear scan would grow with it (about 1000x
+from 1k to 1M users). Password hashing is not included.
+
+Run: python scripts/loginBenchmark.py [--sizes 1000,10000,100000,1000000] [--lookups 20000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "messenger_api"))
+
+from storage import SQLiteBackend, UserStore  # noqa: E402
+
+
+def build_store(size: int) -> UserStore:
+    db_path = os.path.join(tempfile.mkdtemp(prefix="login-bench-"), "messenger.db")
+    backend = SQLiteBackend(db_path)
+    for start in range(0, size, 50000):
+        backend.put_users([
+            {"id": i, "name": f"user{i}", "email": f"user{i}@bench.test",
+             "phone": f"+1{i:010d}", "idNumber": f"FWP{i}"}
+            for i in range(start, min(size, start + 50000))
+        ])
+    return UserStore(backend)
+
+
+def time_lookups(store: UserStore, logins: list) -> tuple:
+    """(p50, p99) microseconds per find_by_login call"""
+    samples = []
+    for login in logins:
+        start = time.perf_counter_ns()
+        store.find_by_login(login)
+        samples.append(time.perf_counter_ns() - start)
+    samples.sort()
+    return samples[len(samples) // 2] / 1000, samples[int(len(samples) * 0.99)] / 1000
+
+
+def run(sizes: list, lookups: int) -> bool:
+    rnd = random.Random(1)
+    results = {}
+    print(f"{'users':>10} {'hit p50':>9} {'hit p99':>9} {'miss p50':>9} {'miss p99':>9}  (us)")
+    for size in sizes:
+        store = build_store(size)
+        # Half by email, half by phone (the phone path misses the email index first)
+        hits = [f"user{i}@bench.test" if i % 2 else f"+1{i:010d}"
+                for i in (rnd.randrange(size) for _ in range(lookups))]
+        misses = [f"nobody{i}@bench.test" for i in range(lookups)]
+        results[size] = time_lookups(store, hits) + time_lookups(store, misses)
+        print(f"{size:>10,} " + " ".join(f"{value:>9.2f}" for value in results[size]))
+        store.close()
+
+    smallest, largest = results[sizes[0]], results[sizes[-1]]
+    # Flat: medians may drift up as the tables outgrow the CPU caches, but stay
+    # within 10x (+1 us of timer noise) across the whole range
+    checks = {
+        "hit latency flat": largest[0] <= 10 * smallest[0] + 1,
+        "miss latency flat": largest[2] <= 10 * smallest[2] + 1,
+    }
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        help="comma separated user counts")
+    parser.add_argument("--lookups", type=int, default=20000, help="timed lookups per kind and size")
+    args = parser.parse_args()
+    sys.exit(0 if run([int(s) for s in args.sizes.split(",")], args.lookups) else 1)
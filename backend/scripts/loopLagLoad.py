@@ -0,0 +1,162 @@
+"""
+Event Loop Lag Load Test
+Starts the messenger API under uvicorn on a scratch database and upload
+directory, drives signups, logins, profile updates, uploads, message sends and
+history reads at it from many concurrent clients at a fixed total request
+rate, then reads GET /metrics/io and checks that event-loop lag stayed under
+the target at p99.
+
+The rate is fixed (open loop) rather than as-fast-as-possible: a saturated
+CPU delays every timer whether or not anything blocks the loop. Keep --rate
+below what the box sustains, and give the server its own cores where
+possible, since this client shares the machine. The idle timer lag of a bare
+event loop on the same machine is printed first as a baseline: the server's
+figure can't be lower than that.
+
+Run: python scripts/loopLagLoad.py [--clients 32] [--rate 100] [--duration 30] [--max-lag-ms 1]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+MESSENGER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "messenger_api")
+UPLOAD_BYTES = 256 * 1024
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int) -> subprocess.Popen:
+    scratch = tempfile.mkdtemp(prefix="loop-lag-")
+    env = dict(
+        os.environ,
+        MESSENGER_DB=os.path.join(scratch, "messenger.db"),
+        MESSENGER_UPLOAD_DIR=os.path.join(scratch, "uploads"),
+        MESSENGER_RATE_LIMITS="",
+        MESSENGER_LOGIN_ACCOUNT_LIMIT="1000000/min",
+        # Cheap KDF: the test is about the event loop, not password cost
+        MESSENGER_SCRYPT_N="1024",
+    )
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", MESSENGER_DIR,
+         "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+
+
+async def idle_lag(samples: int = 50, interval: float = 0.1) -> float:
+    """p99 lag (ms) of a timer on an otherwise idle loop in this process"""
+    loop = asyncio.get_running_loop()
+    lags = []
+    for _ in range(samples):
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - expected)
+    lags.sort()
+    return round(lags[min(len(lags) - 1, int(0.99 * len(lags)))] * 1000, 3)
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+        await asyncio.sleep(0.2)
+
+
+async def user_session(client: httpx.AsyncClient, n: int, interval: float, until: float, counts: dict) -> None:
+    """One simulated user: sign up, then send one of the other requests every interval seconds"""
+    rnd = random.Random(n)
+    email = f"load{n}-{rnd.random()}@load.test"
+    response = await client.post("/auth/signup", json={"name": f"load{n}", "email": email, "password": "pw"})
+    response.raise_for_status()
+    token = response.json()["token"]
+    auth = {"Authorization": f"Bearer {token}"}
+    user_id = response.json()["user"]["id"]
+    conversation = f"load{n % 8}"
+    payload = os.urandom(UPLOAD_BYTES)
+
+    # Spread the clients' requests over the interval instead of sending them in bursts
+    next_at = time.monotonic() + rnd.random() * interval
+    while next_at < until:
+        await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        next_at += interval
+        action = rnd.random()
+        if action < 0.05:
+            response = await client.post("/auth/login", json={"email": email, "password": "pw"})
+        elif action < 0.15:
+            response = await client.put("/auth/profile", json={"bio": f"bio {rnd.random()}"}, headers=auth)
+        elif action < 0.25:
+            files = {"file": (f"f{rnd.random()}.bin", payload[:rnd.randrange(1, UPLOAD_BYTES)])}
+            response = await client.post("/upload", files=files, headers=auth)
+        elif action < 0.6:
+            response = await client.post("/messages/send", json={
+                "conversationId": conversation, "senderId": user_id, "content": "hello"})
+        else:
+            response = await client.get(f"/conversations/{conversation}")
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+
+async def drive(port: int, clients: int, rate: float, duration: float) -> tuple:
+    limits = httpx.Limits(max_connections=clients)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60, limits=limits) as client:
+        await wait_ready(client)
+        counts = {}
+        until = time.monotonic() + duration
+        await asyncio.gather(*(user_session(client, n, clients / rate, until, counts) for n in range(clients)))
+        metrics = (await client.get("/metrics/io")).json()
+    return counts, metrics
+
+
+def run(clients: int, rate: float, duration: float, max_lag_ms: float) -> bool:
+    print(f"idle event loop on this machine: p99 timer lag {asyncio.run(idle_lag())} ms")
+    port = free_port()
+    server = start_server(port)
+    try:
+        counts, metrics = asyncio.run(drive(port, clients, rate, duration))
+    finally:
+        server.terminate()
+        server.wait()
+
+    lag, pool = metrics["loop_lag"], metrics["io_pool"]
+    total = sum(counts.values())
+    print(f"{clients} clients for {duration:.0f}s: {total:,} requests ({total / duration:,.0f}/sec), status {counts}")
+    print(f"loop lag over {lag['samples']} samples: p50 {lag['p50_ms']} ms, p99 {lag['p99_ms']} ms, max {lag['max_ms']} ms")
+    print(f"io pool: {pool['workers']} workers, peak queued {pool['peak_queued']}, "
+          f"peak wait {pool['peak_wait_ms']} ms, {pool['completed']:,} calls")
+    print(f"user writer: {metrics['writer']['records']:,} records in {metrics['writer']['flushes']:,} flushes")
+
+    checks = {
+        "all requests succeeded": set(counts) == {200},
+        f"loop lag p99 under {max_lag_ms} ms": lag["p99_ms"] < max_lag_ms,
+    }
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--rate", type=float, default=100, help="requests per second, all clients together")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="seconds of load (the server keeps the last 60 s of lag samples)")
+    parser.add_argument("--max-lag-ms", type=float, default=1.0)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.clients, args.rate, args.duration, args.max_lag_ms) else 1)
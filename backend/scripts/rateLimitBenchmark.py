@@ -0,0 +1,117 @@
+"""
+Rate Limiter Overhead Benchmark
+Times what the shared rate limiter adds to a request: RateLimiter.check on
+limited and unlimited routes with many distinct clients, and the whole
+ASGIRateLimit middleware around a no-op ASGI app compared with the bare app.
+Each check should cost under --max-us microseconds (10 by default), and
+stay there as the number of client buckets grows.
+
+Run: python scripts/rateLimitBenchmark.py [--requests 200000] [--clients 100000] [--max-us 10]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ratelimit import ASGIRateLimit, RateLimiter, parse_rules  # noqa: E402
+
+# The messenger API's default rules, with limits high enough that nothing is refused
+RULES = """
+    POST /auth/login 1000000/min ip
+    POST /auth/signup 1000000/min ip
+    POST /upload 1000000/min account
+    POST /attachments/upload 1000000/min account
+    POST /stories/upload 1000000/min account
+    POST /attachments/uploads 1000000/min account
+    PUT /attachments/uploads/* 1000000/min account
+"""
+
+
+def make_limiter() -> RateLimiter:
+    # Stands in for the token -> user lookup, which the auth cache answers from memory
+    return RateLimiter(parse_rules(RULES), identify=lambda authorization: authorization[7:], trust_proxy=1)
+
+
+def time_checks(limiter: RateLimiter, method: str, path: str, requests: int, clients: int) -> float:
+    """Microseconds per RateLimiter.check (client_ip included), clients round-robin"""
+    ips = [f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}" for n in range(clients)]
+    headers = [f"Bearer u{n}" for n in range(clients)]
+    start = time.perf_counter()
+    for n in range(requests):
+        ip = limiter.client_ip("127.0.0.1", ips[n % clients])
+        limiter.check(method, path, ip, headers[n % clients])
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def time_asgi(requests: int, clients: int) -> tuple:
+    """(bare app, app behind ASGIRateLimit) microseconds per POST /auth/login"""
+    async def app(scope, receive, send):
+        pass
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    scopes = [{
+        "type": "http", "method": "POST", "path": "/auth/login", "client": ("127.0.0.1", 50000),
+        "headers": [(b"host", b"localhost"), (b"content-type", b"application/json"),
+                    (b"x-forwarded-for", f"10.0.{n >> 8 & 255}.{n & 255}".encode())],
+    } for n in range(clients)]
+
+    async def measure(handler) -> float:
+        start = time.perf_counter()
+        for n in range(requests):
+            await handler(scopes[n % clients], receive, send)
+        return (time.perf_counter() - start) / requests * 1e6
+
+    async def main():
+        return await measure(app), await measure(ASGIRateLimit(app, make_limiter()))
+
+    return asyncio.run(main())
+
+
+def run(requests: int, clients: int, max_us: float) -> bool:
+    results = {}
+    for label, method, path in [
+        ("limited route (ip)", "POST", "/auth/login"),
+        ("limited route (account, prefix)", "PUT", "/attachments/uploads/abc123"),
+        ("unlimited route", "GET", "/conversations/abc"),
+    ]:
+        for count in (1, clients):
+            limiter = make_limiter()
+            results[label, count] = time_checks(limiter, method, path, requests, count)
+            print(f"{label:>32}, {count:>7,} clients: {results[label, count]:6.2f} us/check, "
+                  f"{len(limiter.buckets):,} buckets")
+
+    bare, limited = time_asgi(requests, min(clients, 65536))
+    print(f"ASGI POST /auth/login: bare app {bare:.2f} us, with ASGIRateLimit {limited:.2f} us "
+          f"(+{limited - bare:.2f} us)")
+
+    limiter = make_limiter()
+    time_checks(limiter, "POST", "/auth/login", clients, clients)
+    start = time.perf_counter()
+    limiter.buckets._sweep(limiter.buckets.clock() + 3600)
+    print(f"expiry sweep of {clients:,} buckets: {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"(once per sweep interval)")
+
+    checks = {f"{label}, {count:,} clients under {max_us} us": us < max_us for (label, count), us in results.items()}
+    checks[f"ASGI middleware overhead under {max_us} us"] = limited - bare < max_us
+    checks["sweep drops refilled buckets"] = len(limiter.buckets) == 0
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200000, help="timed checks per case")
+    parser.add_argument("--clients", type=int, default=100000, help="distinct client IPs/accounts")
+    parser.add_argument("--max-us", type=float, default=10.0, help="per-request budget in microseconds")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.requests, args.clients, args.max_us) else 1)
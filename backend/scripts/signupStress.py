@@ -0,0 +1,120 @@
+"""
+Signup Stress Test
+Fires thousands of parallel signups at UserStore, from concurrent coroutines,
+threads and two processes sharing one SQLite file, and checks that every
+user ID is handed out once and every signup is stored.
+
+Run: python scripts/signupStress.py [--signups 5000] [--threads 8] [--block-size 10]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "messenger_api"))
+
+from storage import SQLiteBackend, UserStore  # noqa: E402
+
+
+def signups(db_path: str, count: int, block_size: int, tag: str) -> list:
+    """count parallel signups (allocate_id + insert) against db_path; returns the IDs"""
+    async def main():
+        store = UserStore(SQLiteBackend(db_path), id_block_size=block_size, commit_window=0.002)
+        await store.start()
+
+        async def signup(i: int) -> int:
+            user_id = await store.allocate_id()
+            await store.insert({"id": user_id, "email": f"{tag}-{i}@stress.test", "name": tag})
+            return user_id
+
+        ids = await asyncio.gather(*(signup(i) for i in range(count)))
+        await store.stop()
+        store.close()
+        return ids
+
+    return asyncio.run(main())
+
+
+def process_worker(db_path: str, count: int, block_size: int, tag: str, results) -> None:
+    results.put(signups(db_path, count, block_size, tag))
+
+
+def thread_allocations(db_path: str, threads: int, per_thread: int, block_size: int) -> list:
+    """IdAllocator.allocate() from many threads on one store"""
+    store = UserStore(SQLiteBackend(db_path), id_block_size=block_size)
+    ids = []
+    ids_lock = threading.Lock()
+
+    def worker():
+        local = [store.ids.allocate() for _ in range(per_thread)]
+        with ids_lock:
+            ids.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    store.close()
+    return ids
+
+
+def run(count: int, threads: int, block_size: int) -> bool:
+    db_path = os.path.join(tempfile.mkdtemp(prefix="signup-stress-"), "messenger.db")
+    checks = {}
+
+    start = time.perf_counter()
+    async_ids = signups(db_path, count, block_size, "async")
+    elapsed = time.perf_counter() - start
+    print(f"{count} parallel signups in one process: {count / elapsed:,.0f}/sec")
+    checks["unique IDs (coroutines)"] = len(set(async_ids)) == count
+
+    thread_ids = thread_allocations(db_path, threads, count // threads, block_size)
+    print(f"{threads} threads x {count // threads} allocations")
+    checks["unique IDs (threads)"] = len(set(thread_ids)) == len(thread_ids)
+
+    # spawn, not fork: a forked child inherits io_pool's executor without its threads
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    processes = [
+        context.Process(target=process_worker, args=(db_path, count, block_size, f"proc{i}", results))
+        for i in range(2)
+    ]
+    start = time.perf_counter()
+    for p in processes:
+        p.start()
+    process_ids = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+    elapsed = time.perf_counter() - start
+    print(f"2 processes x {count} parallel signups on one database: {2 * count / elapsed:,.0f}/sec")
+    checks["unique IDs (two processes)"] = len(set(process_ids[0]) | set(process_ids[1])) == 2 * count
+
+    every_id = async_ids + thread_ids + process_ids[0] + process_ids[1]
+    checks["no ID reused across runs"] = len(set(every_id)) == len(every_id)
+
+    with sqlite3.connect(db_path) as conn:
+        stored = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        high_water = int(conn.execute("SELECT value FROM meta WHERE key = 'next_id'").fetchone()[0])
+    checks["every signup stored"] = stored == 3 * count
+    checks["high-water mark above every ID"] = high_water > max(every_id)
+
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--signups", type=int, default=5000, help="parallel signups per run")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--block-size", type=int, default=10,
+                        help="IDs per reserved block (small blocks make reservations race more)")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.signups, args.threads, args.block_size) else 1)
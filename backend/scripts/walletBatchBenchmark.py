@@ -0,0 +1,152 @@
+"""
+Wallet Batch Benchmark
+Applies thousands of wallet mutations (tournament entry fees and payouts) one
+call at a time and through WalletLedger.apply_batch, with and without fsync,
+then through POST /api/wallet/batch, counting log flushes: one per call on
+the per-operation path, one per batch (whatever its size) on the batch path,
+and none for a rejected batch.
+
+Run: python scripts/walletBatchBenchmark.py [--operations 10000] [--users 500] [--fsync-operations 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "game_server"))
+
+# walletLedger creates its global ledger on import; keep it out of the real data dir
+os.environ.setdefault("GAME_WALLET_DIR", tempfile.mkdtemp(prefix="wallet-default-"))
+
+from walletLedger import WalletLedger  # noqa: E402
+
+
+def count_flushes(ledger: WalletLedger) -> list:
+    """Wrap ledger._append (one log write + flush, + fsync if enabled); returns [calls, records]"""
+    counts = [0, 0]
+    append = ledger._append
+
+    def counted(records):
+        counts[0] += 1
+        counts[1] += len(records)
+        append(records)
+
+    ledger._append = counted
+    return counts
+
+
+def tournament(count: int, users: int, seed: int = 1) -> list:
+    """Entry fees for every player, then payouts to a few winners, repeated up to count operations"""
+    rnd = random.Random(seed)
+    operations = []
+    while len(operations) < count:
+        players = rnd.sample(range(users), min(users, 64))
+        operations += [{"user_id": f"user{p}", "type": "deduct", "amount": 10, "game": "ludo"} for p in players]
+        operations += [{"user_id": f"user{p}", "type": "reward", "amount": 160, "game": "ludo"} for p in players[:4]]
+    return operations[:count]
+
+
+def time_ledger(operations: list, batch_size: int, fsync: bool) -> tuple:
+    """(operations/sec, flushes, balances) applying operations in batches of batch_size (0 = one call each)"""
+    ledger = WalletLedger(tempfile.mkdtemp(prefix="wallet-batch-"), snapshot_every=10 ** 9, fsync=fsync)
+    counts = count_flushes(ledger)
+    start = time.perf_counter()
+    if batch_size:
+        for offset in range(0, len(operations), batch_size):
+            ledger.apply_batch(operations[offset:offset + batch_size])
+    else:
+        for op in operations:
+            if op["type"] == "deduct":
+                ledger.deduct(op["user_id"], op["amount"], op["game"])
+            else:
+                ledger.reward(op["user_id"], op["amount"], op["game"])
+    elapsed = time.perf_counter() - start
+    balances = dict(ledger.balances)
+    ledger.close()
+    return len(operations) / elapsed, counts[0], balances
+
+
+def time_endpoint(operations: list) -> dict:
+    """One POST /api/wallet/batch with every operation, then one that must be rejected"""
+    from fastapi.testclient import TestClient
+
+    # main.py serves game_server/games and game_server/assets relative to the
+    # working directory; the assets ship with the clients, so when they're
+    # absent run from a scratch directory with the games and an empty assets dir
+    if not os.path.isdir(os.path.join("game_server", "assets")):
+        scratch = os.path.join(tempfile.mkdtemp(prefix="wallet-batch-cwd-"), "game_server")
+        os.makedirs(os.path.join(scratch, "assets"))
+        os.symlink(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "game_server", "games"),
+                   os.path.join(scratch, "games"))
+        os.chdir(os.path.dirname(scratch))
+    import main
+
+    counts = count_flushes(main.wallet_ledger)
+    body = [{"user_id": op["user_id"], "type": op["type"], "amount": op["amount"], "game_name": op["game"]}
+            for op in operations]
+    with TestClient(main.app) as client:
+        start = time.perf_counter()
+        response = client.post("/api/wallet/batch", json={"operations": body})
+        elapsed = time.perf_counter() - start
+        flushes = counts[0]
+        before = dict(main.wallet_ledger.balances)
+        # The last operation overdraws, so the whole batch must be refused
+        overdraw = body[:-1] + [{"user_id": body[0]["user_id"], "type": "deduct", "amount": 10 ** 9}]
+        rejected = client.post("/api/wallet/batch", json={"operations": overdraw})
+        results = rejected.json()["detail"]["results"] if rejected.status_code == 400 else []
+        return {
+            "ok": response.status_code == 200 and len(response.json()["results"]) == len(operations),
+            "elapsed": elapsed,
+            "flushes": flushes,
+            "rejected": rejected.status_code == 400 and counts[0] == flushes
+                        and main.wallet_ledger.balances == before,
+            "failed_index": [r["index"] for r in results if not r["success"]],
+        }
+
+
+def run(count: int, users: int, fsync_count: int) -> bool:
+    operations = tournament(count, users)
+    checks = {}
+
+    print(f"{'path':>28} {'ops':>7} {'flushes':>8} {'ops/sec':>10}")
+    rate, flushes, single = time_ledger(operations, 0, fsync=False)
+    print(f"{'one call per operation':>28} {count:>7,} {flushes:>8,} {rate:>10,.0f}")
+    checks["one flush per operation without batching"] = flushes == count
+    for batch_size in sorted({1000, count}):
+        rate, flushes, batched = time_ledger(operations, batch_size, fsync=False)
+        batches = -(-count // batch_size)
+        print(f"{f'apply_batch of {batch_size:,}':>28} {count:>7,} {flushes:>8,} {rate:>10,.0f}")
+        checks[f"batches of {batch_size:,}: one flush per batch"] = flushes == batches
+        checks[f"batches of {batch_size:,}: same balances as one call each"] = batched == single
+
+    fsync_ops = operations[:fsync_count]
+    single_rate, _, _ = time_ledger(fsync_ops, 0, fsync=True)
+    batch_rate, flushes, _ = time_ledger(fsync_ops, fsync_count, fsync=True)
+    print(f"{'fsync, one call each':>28} {fsync_count:>7,} {fsync_count:>8,} {single_rate:>10,.0f}")
+    print(f"{'fsync, one apply_batch':>28} {fsync_count:>7,} {flushes:>8,} {batch_rate:>10,.0f}")
+    checks["fsync: one flush for the batch"] = flushes == 1
+
+    endpoint = time_endpoint(operations)
+    print(f"POST /api/wallet/batch with {count:,} operations: {endpoint['elapsed'] * 1000:,.0f} ms, "
+          f"{endpoint['flushes']} flush")
+    checks[f"{count:,} operations in one request"] = endpoint["ok"]
+    checks["one flush per request"] = endpoint["flushes"] == 1
+    checks["rejected batch applies nothing and writes nothing"] = endpoint["rejected"]
+    checks["rejected batch names the failing operation"] = endpoint["failed_index"] == [count - 1]
+
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--operations", type=int, default=10000,
+                        help="mutations in the batch (at most GAME_WALLET_BATCH_MAX for the endpoint)")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--fsync-operations", type=int, default=2000, help="mutations timed with fsync on")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.operations, args.users, args.fsync_operations) else 1)
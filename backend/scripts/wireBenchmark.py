@@ -0,0 +1,116 @@
+"""
+Websocket Wire Format Benchmark
+Encodes typical websocket frames (a single chat message, a batch of stored
+messages, a presence update) with every codec wire.py offers, and compares
+bytes on the wire and CPU per message (encode and decode) against the plain
+JSON text frames. Then publishes one broadcast to a room of mixed-codec
+connections, to check it is encoded once per codec rather than once per
+connection.
+
+Run: python scripts/wireBenchmark.py [--iterations 20000] [--batch 20] [--recipients 1000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "messenger_api"))
+
+from wire import CODECS, JSON, Broadcast  # noqa: E402
+
+
+def message(n: int) -> dict:
+    return {
+        "id": 1_000_000 + n,
+        "conversationId": "conv-4821",
+        "seq": 52_000 + n,
+        "senderId": str(n % 7),
+        "content": f"message {n}: see you at the station around half past six?",
+        "timestamp": 1_760_000_000.123 + n,
+        "edited": False,
+    }
+
+
+def sample_frames(batch: int) -> dict:
+    return {
+        "message": {"type": "messages", "conversationId": "conv-4821", "messages": [message(0)]},
+        f"batch of {batch}": {"type": "messages", "conversationId": "conv-4821",
+                              "messages": [message(n) for n in range(batch)]},
+        "presence": {"type": "presence", "events": [
+            {"userId": str(n), "status": "online", "room": "conv-4821"} for n in range(5)]},
+    }
+
+
+def per_call_us(fn, arg, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(arg)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def measure(frames: dict, iterations: int) -> dict:
+    """{(frame name, codec name): (bytes, encode us, decode us)}"""
+    results = {}
+    for frame_name, frame in frames.items():
+        for codec in CODECS.values():
+            data = codec.encode(frame)
+            assert codec.decode(data) == frame, f"{codec.name} does not round-trip {frame_name}"
+            size = len(data.encode("utf-8") if isinstance(data, str) else data)
+            results[frame_name, codec.name] = (size, per_call_us(codec.encode, frame, iterations),
+                                               per_call_us(codec.decode, data, iterations))
+    return results
+
+
+def broadcast_encodes(frame: dict, recipients: int) -> tuple:
+    """(encodes done, codecs in use) for one broadcast to recipients spread over every codec"""
+    codecs = list(CODECS.values())
+    broadcast = Broadcast(json.dumps(frame))
+    for n in range(recipients):
+        broadcast.encoded(codecs[n % len(codecs)])
+    # The JSON text frame is the relayed frame itself and is never re-encoded
+    return broadcast.encodes, len(codecs) - 1
+
+
+def run(iterations: int, batch: int, recipients: int) -> bool:
+    frames = sample_frames(batch)
+    results = measure(frames, iterations)
+    print(f"codecs: {', '.join(CODECS)}")
+    for frame_name in frames:
+        messages = len(frames[frame_name].get("messages") or [None])
+        json_size = results[frame_name, JSON.name][0]
+        print(f"\n{frame_name} ({messages} message{'s' if messages > 1 else ''})")
+        print(f"{'codec':>16} {'bytes':>7} {'vs json':>8} {'encode us/msg':>14} {'decode us/msg':>14}")
+        for codec_name in CODECS:
+            size, encode_us, decode_us = results[frame_name, codec_name]
+            print(f"{codec_name:>16} {size:>7,} {size / json_size:>7.0%} "
+                  f"{encode_us / messages:>14.2f} {decode_us / messages:>14.2f}")
+
+    encodes, expected = broadcast_encodes(frames[f"batch of {batch}"], recipients)
+    print(f"\nbroadcast to {recipients:,} connections over {len(CODECS)} codecs: {encodes} encodes")
+
+    binary = [name for name in CODECS if name != JSON.name and not name.endswith(".deflate")]
+    checks = {
+        "a binary encoding is available (msgpack/cbor installed)": bool(binary),
+        f"binary encodings smaller than JSON for a batch of {batch}": all(
+            results[f"batch of {batch}", name][0] < results[f"batch of {batch}", JSON.name][0]
+            for name in binary),
+        f"deflate shrinks a batch of {batch}": all(
+            results[f"batch of {batch}", name + ".deflate"][0] < results[f"batch of {batch}", name][0]
+            for name in [JSON.name] + binary),
+        "broadcast encoded once per codec": encodes == expected,
+    }
+    print()
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000, help="timed encodes/decodes per frame and codec")
+    parser.add_argument("--batch", type=int, default=20, help="messages in the batch frame")
+    parser.add_argument("--recipients", type=int, default=1000, help="connections receiving the broadcast")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.iterations, args.batch, args.recipients) else 1)
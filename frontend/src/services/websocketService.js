@@ -25,6 +25,11 @@ class WebSocketService {
     this.ws.onmessage = (ev) => {
       let data = ev.data;
       try { data = JSON.parse(ev.data); } catch (e) { }
+      // Answer the server's heartbeat, or it drops the connection as dead
+      if (data && data.type === 'ping') {
+        this.send({ type: 'pong' });
+        return;
+      }
       this.listeners.forEach((cb) => cb(data));
     };
 